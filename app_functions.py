@@ -7,6 +7,7 @@ from PyQt5.QtWidgets import QFileDialog
 import sys
 import cv2
 import time
+from capture_functions import *
 
 
 desc_text = "This app is designed for collecting image data from the Azure Kinect DK camera." \
@@ -40,45 +41,6 @@ def set_treeView(window, directory):
 def set_status(window, status_text):
     window.Status_TXT.setText(status_text)
     
-def colorize_depth(depth_image):
-    depth_image = cv2.convertScaleAbs(depth_image, alpha=0.05)
-    depth_image = cv2.applyColorMap(depth_image, cv2.COLORMAP_TURBO)# cv2.COLORMAP_JET, cv2.COLORMAP_TURBO
-    return depth_image
-
-def get_frame(myK4a, view):
-    capture = myK4a.get_capture()
-    if capture.color is not None and capture.depth is not None:
-        
-        if view == 'Color':
-            color_image = capture.color
-            im = color_image
-        elif view == 'Depth':
-            depth = capture.transformed_depth
-            depth = colorize_depth(depth)
-            im = depth
-        elif view == 'IR':
-            ir_image = capture.transformed_ir
-            ir_image = cv2.convertScaleAbs(ir_image, alpha=0.10)
-            im = ir_image
-        else:
-            im = color_image
-    return cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
- 
-def get_recent_frame(myK4a, dummy):
-    capture = myK4a.get_capture()
-    if capture.color is not None and capture.depth is not None:
-            dummy['rgb']=capture.color
-            dummy['depth']=cv2.convertScaleAbs(capture.transformed_depth, alpha=0.05)
-            dummy['ir']=cv2.convertScaleAbs(capture.transformed_ir, alpha=0.10)
-            
-    return dummy
-
-def save_data(data, dir, name, fmt):
-    
-    cv2.imwrite(os.path.join(dir, 'rgb', name + fmt), data['rgb'])
-    cv2.imwrite(os.path.join(dir, 'ir', name + fmt), data['ir'])
-    cv2.imwrite(os.path.join(dir, 'depth', name + fmt), data['depth'])
-    
 """
 ------------------------------------------------------------------------------------------------------------------------
 Main functions
@@ -0,0 +1,168 @@
+# Description: Per-stage micro-benchmarks of the capture hot path on synthetic frames
+# usage: python bench_pipeline.py --output bench.json
+#        python bench_pipeline.py --baseline bench.json --threshold 0.2   (exit code 1 if a stage regressed)
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import cv2
+import numpy as np
+import pyk4a
+
+from capture_functions import get_frame, get_recent_frame, colorize_depth, colorize_ir, save_data
+from frame_buffer import FrameBuffer, COLOR_SHAPES, DEPTH_SHAPES
+from frame_sources import SyntheticSource
+from raw_session import RawSessionWriter, RAW_FMT
+
+
+IMAGE_FORMATS = ('.png', '.jpg', '.bmp', '.tiff')
+PREVIEW_SIZE = (1235, 698) # scroll area of myK4a_app.ui at its default size
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolutions', type=str, default=','.join(i.name for i in COLOR_SHAPES), help='Comma separated ColorResolution names')
+parser.add_argument('--depth_modes', type=str, default=','.join(i.name for i in DEPTH_SHAPES if i != pyk4a.DepthMode.PASSIVE_IR), help='Comma separated DepthMode names')
+parser.add_argument('--formats', type=str, default=','.join(IMAGE_FORMATS + (RAW_FMT,)), help='Comma separated saving formats')
+parser.add_argument('--iterations', type=int, default=20, help='Timed runs per stage')
+parser.add_argument('--warmup', type=int, default=2, help='Untimed runs per stage')
+parser.add_argument('--output', type=str, default='bench_results.json', help='Where to write the results')
+parser.add_argument('--baseline', type=str, default='', help='Results file to compare against')
+parser.add_argument('--threshold', type=float, default=0.2, help='Fail if a stage p50 is this fraction slower than the baseline')
+
+
+def time_stage(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    times = np.empty(iterations)
+    for i in range(iterations):
+        tic = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - tic
+    return {
+        'fps': float(1.0 / times.mean()),
+        'p50_ms': float(np.percentile(times, 50) * 1000),
+        'p99_ms': float(np.percentile(times, 99) * 1000),
+        'iterations': iterations,
+    }
+
+def qt_update_image():
+    # the QImage/QPixmap part of MyWindow.update_image, None if PyQt5 cannot run here
+    try:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5 import QtWidgets, QtGui
+    except ImportError:
+        return None
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+
+    def update_image(im):
+        h, w, channels = im.shape
+        qImg = QtGui.QImage(im.data, w, h, channels * w, QtGui.QImage.Format_RGB888)
+        return QtGui.QPixmap.fromImage(qImg)
+    update_image.app = app # keep the application alive
+    return update_image
+
+def bench_config(res, depth_mode, formats, iterations, warmup, work_dir, update_image):
+    config = pyk4a.Config(color_resolution=res, depth_mode=depth_mode)
+    source = SyntheticSource(config, fps=1e9) # no pacing
+    source.start()
+    results = {}
+
+    for view in ('Color', 'Depth', 'IR'):
+        results['get_frame_' + view.lower()] = time_stage(lambda: get_frame(source, view), iterations, warmup)
+        results['get_frame_' + view.lower() + '_preview'] = time_stage(lambda: get_frame(source, view, size=PREVIEW_SIZE), iterations, warmup)
+
+    depth = source.get_capture().transformed_depth
+    results['colorize_depth'] = time_stage(lambda: colorize_depth(depth), iterations, warmup)
+    ir = source.get_capture().transformed_ir
+    results['colorize_ir'] = time_stage(lambda: colorize_ir(ir), iterations, warmup)
+
+    frame_buffer = FrameBuffer(config, 1)
+    slot = frame_buffer.acquire()
+    results['get_recent_frame'] = time_stage(lambda: get_recent_frame(source, slot), iterations, warmup)
+
+    for fmt in formats:
+        session_dir = os.path.join(work_dir, fmt.strip('.'))
+        if fmt == RAW_FMT:
+            raw_buffer = FrameBuffer(config, 1, depth_dtype=np.uint16)
+            raw_slot = get_recent_frame(source, raw_buffer.acquire())
+            os.makedirs(session_dir)
+            writer = RawSessionWriter(session_dir, raw_buffer, config)
+            results['save_data' + fmt] = time_stage(lambda: writer.write(raw_slot).flush(), iterations, warmup)
+            writer.close()
+        else:
+            for stream in frame_buffer.streams:
+                os.makedirs(os.path.join(session_dir, stream))
+            results['save_data' + fmt] = time_stage(lambda: save_data(slot, session_dir, 'Img_0000', fmt), iterations, warmup)
+        shutil.rmtree(session_dir)
+
+    if update_image is not None:
+        rgb = get_frame(source, 'Color', size=PREVIEW_SIZE) # the threads scale frames down before emitting them
+        results['update_image'] = time_stage(lambda: update_image(rgb), iterations, warmup)
+
+    source.stop()
+    return results
+
+def compare(results, baseline, threshold):
+    # stages whose p50 got slower than the baseline by more than threshold
+    regressions = []
+    for key, stages in results.items():
+        for stage, stats in stages.items():
+            base = baseline.get(key, {}).get(stage)
+            if base is None:
+                continue
+            change = stats['p50_ms'] / base['p50_ms'] - 1
+            if change > threshold:
+                regressions.append((key, stage, base['p50_ms'], stats['p50_ms'], change))
+    return regressions
+
+def main(args):
+    resolutions = [pyk4a.ColorResolution[i.strip()] for i in args.resolutions.split(',') if i.strip()]
+    depth_modes = [pyk4a.DepthMode[i.strip()] for i in args.depth_modes.split(',') if i.strip()]
+    formats = [i.strip() for i in args.formats.split(',') if i.strip()]
+    update_image = qt_update_image()
+    if update_image is None:
+        print("PyQt5 not available, skipping update_image")
+
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='k4a_bench_')
+    try:
+        for res in resolutions:
+            for depth_mode in depth_modes:
+                key = res.name + '|' + depth_mode.name
+                print("Benchmarking " + key)
+                results[key] = bench_config(res, depth_mode, formats, args.iterations, args.warmup, work_dir, update_image)
+                for stage, stats in results[key].items():
+                    print("    {:<22} {:8.1f} fps  p50 {:8.2f} ms  p99 {:8.2f} ms".format(stage, stats['fps'], stats['p50_ms'], stats['p99_ms']))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'machine': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'opencv': cv2.__version__,
+                'numpy': np.__version__,
+            },
+            'results': results,
+        }, f, indent=2)
+    print("Results written to: " + args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for key, stage, before, after, change in regressions:
+            print("REGRESSION {} {}: p50 {:.2f} -> {:.2f} ms (+{:.0%})".format(key, stage, before, after, change))
+        if regressions:
+            return 1
+        print("No stage regressed by more than {:.0%}".format(args.threshold))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
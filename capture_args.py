@@ -0,0 +1,73 @@
+# Description: Command line options shared by the GUI app and headless capture
+
+import os
+import argparse
+import pyk4a
+from frame_buffer import STREAMS, GEOMETRIES
+from encoder_pool import default_workers
+from frame_sources import SOURCES
+from capture_pipeline import BACKPRESSURE
+from colorize import COLORMAPS, DEPTH_RANGE, IR_RANGE
+from device_calibration import CALIBRATION_DIR
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--working_dir', type=str, default=os.getcwd(), help='Directory to save data to')
+parser.add_argument('--folder_name', type=str, default='test_data', help='Name to save data as')
+parser.add_argument('--view', type=str, default='Color', help='Default view to show')
+parser.add_argument('--ui_file', type=str, default='myK4a_app.ui', help='Name of the UI file to use')
+parser.add_argument('--delay', type=int, default=100, help='Target period in milliseconds between saved frames, kept frames are picked by device timestamp')
+parser.add_argument('--keep_every', type=int, default=0, help='Keep every n-th camera frame instead of using --delay, 0 to use --delay')
+parser.add_argument('--fmt', type=str, default='.png', help='File format to save images as, .raw keeps uint16 depth/IR in memory-mappable files')
+parser.add_argument('--selected_res', type=int, default=pyk4a.ColorResolution.RES_720P, help='Image Resolution from camera')
+parser.add_argument('--selected_fps', type=int, default=pyk4a.FPS.FPS_30, help='Frame rate from camera')
+parser.add_argument('--selected_color_format', type=int, default=pyk4a.ImageFormat.COLOR_BGRA32, help='Color format from camera')
+parser.add_argument('--selected_depth_mode', type=int, default=pyk4a.DepthMode.NFOV_UNBINNED, help='Depth mode from camera')
+parser.add_argument('--app_title', type=str, default='K4a Capture App', help='Title of the app')
+parser.add_argument('--preview_fps', type=float, default=30, help='Highest rate the preview is redrawn at, 0 for no cap')
+parser.add_argument('--depth_colormap', type=str, default='turbo', choices=COLORMAPS, help='Colormap of the depth preview')
+parser.add_argument('--depth_range', type=str, default='{},{}'.format(*DEPTH_RANGE), help='Depth in millimetres shown from the first to the last color, min,max')
+parser.add_argument('--depth_gamma', type=float, default=1.0, help='Gamma of the depth preview, below 1 spreads the near range')
+parser.add_argument('--ir_range', type=str, default='{},{}'.format(*IR_RANGE), help='IR counts shown from black to white, min,max')
+parser.add_argument('--status_hz', type=float, default=4, help='Rate the status line and progress bar are refreshed at')
+parser.add_argument('--max_qsize', type=int, default=100, help='Maximum size of the queue for the capture thread')
+parser.add_argument('--backpressure', type=str, default='stop', choices=BACKPRESSURE, help='What to do when the frame buffer is full: stop the capture, block, drop the oldest or newest frame, or decimate')
+parser.add_argument('--high_water', type=float, default=0.75, help='Fraction of --max_qsize above which the decimate policy halves the kept rate')
+parser.add_argument('--spill_gb', type=float, default=0, help='Size of the scratch file frames overflow to when the frame buffer backs up, 0 to disable')
+parser.add_argument('--spill_at', type=float, default=0.75, help='Fraction of --max_qsize waiting before new frames go to the spill file')
+parser.add_argument('--spill_dir', type=str, default='', help='Folder of the spill file, the session folder by default')
+parser.add_argument('--streams', type=str, default=','.join(STREAMS), help='Comma separated streams to save (rgb,depth,ir)')
+parser.add_argument('--geometry', type=str, default='color', choices=GEOMETRIES, help='Save depth/IR transformed to the color camera, or native without any transform (register_session.py registers them offline)')
+parser.add_argument('--n_encoders', type=int, default=default_workers(), help='Number of processes encoding frames while saving, 0 to encode on the saving thread')
+parser.add_argument('--source', type=str, default='k4a', choices=SOURCES, help='Frame source: the Azure Kinect, synthetic frames or a replayed session')
+parser.add_argument('--replay_dir', type=str, default='', help='Session folder streamed by the replay source')
+parser.add_argument('--n_devices', type=int, default=1, help='Devices recorded together in wired sync, 0 for every connected device (headless)')
+parser.add_argument('--master', type=str, default='', help='Serial of the sync master, the device with its sync out jack connected by default')
+parser.add_argument('--sync_delay_usec', type=int, default=160, help='Delay of each subordinate after the previous device, keeps their depth lasers apart')
+parser.add_argument('--source_fps', type=float, default=0, help='Frame rate of the synthetic/replay sources, 0 for the camera fps')
+parser.add_argument('--calibration_dir', type=str, default=CALIBRATION_DIR, help='Cache of the per-device ray tables and undistortion maps')
+parser.add_argument('--trace', action=argparse.BooleanOptionalAction, default=True, help='Write per-frame stage times to trace.raw in the session folder')
+parser.add_argument('--fsync', action='store_true', help='fsync every saved file, the trace then includes the time to reach the disk')
+parser.add_argument('--headless', action='store_true', help='Record without the GUI, PyQt5 is not imported')
+parser.add_argument('--duration', type=float, default=0, help='Headless: stop after this many seconds, 0 for no limit')
+parser.add_argument('--n_frames', type=int, default=0, help='Headless: stop after this many frames, 0 for no limit')
+parser.add_argument('--burst_frames', type=int, default=0, help='Headless burst: record this many frames at the full camera rate into memory, then save them')
+parser.add_argument('--burst_seconds', type=float, default=0, help='Headless burst: record this many seconds at the full camera rate into memory, then save them')
+parser.add_argument('--burst_memory', type=float, default=0.8, help='Fraction of the free memory a burst may use, it is cut short to fit')
+
+
+def parse_streams(text):
+    # '--streams rgb,depth' -> ('rgb', 'depth'), unknown names are ignored
+    return tuple(i.strip() for i in text.split(',') if i.strip() in STREAMS)
+
+def parse_range(text):
+    # '--depth_range 500,4000' -> (500, 4000)
+    vmin, vmax = (int(i) for i in text.split(','))
+    return vmin, vmax
+
+def make_config(args):
+    return pyk4a.Config(
+        color_resolution=args.selected_res,
+        depth_mode=args.selected_depth_mode,
+        color_format=args.selected_color_format,
+        camera_fps=args.selected_fps)
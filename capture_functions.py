@@ -0,0 +1,190 @@
+# Description: Capture and saving functions that do not depend on Qt, shared by the GUI and headless mode
+
+import os
+import time
+import cv2
+import numpy as np
+
+from frame_trace import now_ns
+from colorize import COLORIZER
+
+
+def colorize_depth(depth_image):
+    # RGB, with the range and colormap set on COLORIZER (turbo over 0-5.1 m by default)
+    return COLORIZER.view(depth_image, 'Depth')
+
+def colorize_ir(ir_image):
+    # RGB gray scale, the result is a reused buffer like colorize_depth
+    return COLORIZER.view(ir_image, 'IR')
+
+class LazyFrame:
+    # wraps one capture, a stream is only read (and transformed) when asked for, then cached for this capture
+    def __init__(self, capture, geometry='color'):
+        self.capture = capture
+        self.geometry = geometry # 'color': depth/IR transformed to the color camera, 'native': no transform
+        self._cache = {}
+        self.grab_ns = 0 # get_capture called / returned, for the trace
+        self.capture_ns = 0
+        self.temperature = np.nan # device temperature in degrees C, from DeviceTemperature
+        
+    @property
+    def valid(self):
+        return self.capture.color is not None and self.capture.depth is not None
+    
+    @property
+    def timestamp(self):
+        return self.capture.color_timestamp_usec
+    
+    def get(self, stream):
+        if stream not in self._cache:
+            if stream == 'rgb':
+                self._cache[stream] = self.capture.color
+            elif stream == 'depth':
+                self._cache[stream] = self.capture.transformed_depth if self.geometry == 'color' else self.capture.depth
+            elif stream == 'ir':
+                self._cache[stream] = self.capture.transformed_ir if self.geometry == 'color' else self.capture.ir
+            else:
+                raise KeyError(stream)
+        return self._cache[stream]
+    
+    @property
+    def rgb(self):
+        return self.get('rgb')
+    
+    @property
+    def depth(self):
+        return self.get('depth')
+    
+    @property
+    def ir(self):
+        return self.get('ir')
+
+def fit_size(shape, size):
+    # (width, height) an image of `shape` is shown at inside size=(width, height), aspect kept, never enlarged
+    h, w = shape[:2]
+    if not size:
+        return w, h
+    scale = min(size[0] / w, size[1] / h, 1.0)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+def downscale(im, size):
+    # down to the display size, the image itself if it already fits
+    dsize = fit_size(im.shape, size)
+    if dsize == (im.shape[1], im.shape[0]):
+        return im
+    # halve with area interpolation (OpenCV has a fast path for exactly 2x) while the image is twice too big,
+    # then bilinear for the last step, which is less than 2x so it does not alias
+    while im.shape[1] >= 2 * dsize[0] and im.shape[0] >= 2 * dsize[1]:
+        im = cv2.resize(im, (im.shape[1] // 2, im.shape[0] // 2), interpolation=cv2.INTER_AREA)
+    return cv2.resize(im, dsize, interpolation=cv2.INTER_LINEAR)
+
+def preview_image(bgr, size=None):
+    # color slot/frame to the RGB image the preview shows
+    return cv2.cvtColor(downscale(bgr, size), cv2.COLOR_BGR2RGB)
+
+def get_frame(myK4a, view, geometry='color', size=None):
+    # only the stream shown in the preview is read, it is scaled down to size=(width, height) before anything else
+    frame = LazyFrame(myK4a.get_capture(), geometry)
+    if frame.valid:
+        
+        if view == 'Depth':
+            return colorize_depth(downscale(frame.depth, size))
+        elif view == 'IR':
+            return colorize_ir(downscale(frame.ir, size))
+        else:
+            im = downscale(frame.rgb, size)
+    return cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+ 
+class DeviceTemperature:
+    # a capture carries no temperature, the IMU samples do; read on the capture thread at most every `period` seconds
+    def __init__(self, device, period=1.0):
+        self.device = device
+        self.period = period
+        self.value = np.nan
+        self.last = None
+
+    def read(self):
+        now = time.perf_counter()
+        if hasattr(self.device, 'get_imu_sample') and (self.last is None or now - self.last >= self.period):
+            self.last = now
+            try:
+                sample = self.device.get_imu_sample(timeout=0)
+                if sample is not None:
+                    self.value = float(sample['temperature'])
+            except Exception:
+                pass # no sample queued yet, or the IMU is not running: keep the last value
+        return self.value
+
+def grab_capture(myK4a, geometry='color', scheduler=None, temperature=None):
+    # wait for the next capture, None if it is incomplete or the scheduler skips it (nothing is transformed then)
+    grab_ns = now_ns()
+    frame = LazyFrame(myK4a.get_capture(), geometry)
+    frame.grab_ns = grab_ns
+    frame.capture_ns = now_ns()
+    if frame.valid and (scheduler is None or scheduler.keep(frame.timestamp)):
+        if temperature is not None:
+            frame.temperature = temperature.read()
+        return frame
+    return None
+
+def capture_metadata(frame, meta):
+    # manifest fields of a capture, sources without them leave 0 / nan
+    capture = frame.capture
+    meta['device_ts_usec'] = frame.timestamp
+    meta['depth_ts_usec'] = getattr(capture, 'depth_timestamp_usec', 0) or 0
+    meta['ir_ts_usec'] = getattr(capture, 'ir_timestamp_usec', 0) or 0
+    meta['system_ts_nsec'] = getattr(capture, 'color_system_timestamp_nsec', 0) or 0
+    meta['capture_ns'] = frame.capture_ns
+    meta['exposure_usec'] = getattr(capture, 'color_exposure_usec', 0) or 0
+    meta['white_balance'] = getattr(capture, 'color_white_balance', 0) or 0
+    meta['temperature'] = frame.temperature
+    return meta
+
+def fill_slot(frame, slot):
+    # fill a preallocated frame slot in place, only the streams the slot has are read
+    if slot.rgb is not None:
+        np.copyto(slot.rgb, frame.rgb)
+    for stream, alpha in (('depth', 0.05), ('ir', 0.10)):
+        dst = getattr(slot, stream)
+        if dst is None:
+            continue
+        if dst.dtype == np.uint8:
+            # 8-bit images, scaled for viewing
+            cv2.convertScaleAbs(frame.get(stream), dst=dst, alpha=alpha)
+        else:
+            # native uint16 millimetres / IR counts for the raw format
+            np.copyto(dst, frame.get(stream))
+    slot.timestamp = frame.timestamp
+    capture_metadata(frame, slot.meta)
+    slot.trace['grab_ns'] = frame.grab_ns
+    slot.trace['capture_ns'] = frame.capture_ns
+    slot.trace['transform_ns'] = now_ns()
+    return slot
+
+def get_recent_frame(myK4a, slot, geometry='color', scheduler=None):
+    # capture straight into a slot, None if the capture is incomplete or the scheduler skips it
+    frame = grab_capture(myK4a, geometry, scheduler)
+    if frame is None:
+        return None
+    return fill_slot(frame, slot)
+
+def save_data(data, dir, name, fmt, fsync=False):
+    # write every stream the frame has to <dir>/<stream>/<name><fmt>
+    # returns the (encode done, write done) times for the frame trace
+    encoded = []
+    for stream in ('rgb', 'ir', 'depth'):
+        im = getattr(data, stream, None)
+        if im is not None:
+            ok, buf = cv2.imencode(fmt, im)
+            if not ok:
+                raise IOError("Could not encode " + stream + " as " + fmt)
+            encoded.append((stream, buf))
+    encode_ns = now_ns()
+    
+    for stream, buf in encoded:
+        with open(os.path.join(dir, stream, name + fmt), 'wb') as f:
+            f.write(buf)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    return encode_ns, now_ns()
@@ -0,0 +1,95 @@
+# Description: Counters of the worker threads, read by the GUI at a fixed rate instead of every frame
+
+import time
+from types import SimpleNamespace
+
+
+class CaptureMetrics:
+    """
+    The worker threads only bump counters (plain attribute updates, no locks,
+    no formatting, no widget calls); the session keeps its own counters. The GUI
+    calls snapshot() from a timer and shows the result, rates are computed over
+    the time since the previous snapshot.
+
+    post() leaves a message for the GUI, it is shown instead of the counters
+    for hold seconds, or until the next reset() if it is sticky (e.g. the
+    capture stopped because the buffer filled up).
+    """
+    def __init__(self, hold=2.0):
+        self.hold = hold
+        self.reset()
+
+    def reset(self, mode='idle', session=None, mailbox=None):
+        # mode: 'idle', 'preview' or 'capture'
+        self.mode = mode
+        self.session = session
+        self.mailbox = mailbox
+        self.streamed = 0
+        self.errors = 0
+        self.message = None
+        self.message_time = 0.0
+        self.sticky = False
+        self._last = (time.perf_counter(), 0, 0, 0)
+        return self
+
+    def post(self, message, sticky=False):
+        self.message_time = time.perf_counter()
+        self.sticky = sticky
+        self.message = message
+
+    def snapshot(self):
+        now = time.perf_counter()
+        session = self.session
+        captured = session.captured if session is not None else 0
+        saved = session.saved if session is not None else 0
+        last_time, last_streamed, last_captured, last_saved = self._last
+        dt = max(now - last_time, 1e-9)
+        self._last = (now, self.streamed, captured, saved)
+
+        snap = SimpleNamespace(
+            mode=self.mode,
+            message=self.message if self.sticky or now - self.message_time < self.hold else None,
+            streamed=self.streamed,
+            stream_fps=(self.streamed - last_streamed) / dt,
+            errors=self.errors,
+            write_errors=0,
+            captured=captured,
+            saved=saved,
+            dropped=0,
+            spilled=0,
+            queue=0,
+            queue_max=0,
+            capture_fps=(captured - last_captured) / dt,
+            save_fps=(saved - last_saved) / dt,
+            mb_per_s=0.0,
+            achieved_fps=0.0,
+            preview='',
+        )
+        if session is not None:
+            snap.dropped = session.dropped_oldest + session.dropped_newest
+            snap.write_errors = session.write_errors
+            snap.spilled = session.spill.qsize() if session.spill is not None else 0
+            snap.queue = session.frame_buffer.in_use()
+            snap.queue_max = session.frame_buffer.maxsize
+            snap.mb_per_s = snap.save_fps * session.frame_mb
+            if session.scheduler is not None:
+                snap.achieved_fps = session.scheduler.achieved_fps
+        if self.mailbox is not None:
+            snap.preview = self.mailbox.summary_text()
+        return snap
+
+
+def status_text(snap):
+    # one status line for a snapshot
+    if snap.mode == 'preview':
+        return "Preview: {} frames, {:.1f} fps ({})".format(snap.streamed, snap.stream_fps, snap.preview)
+    text = "Captured: {}, saved: {}, dropped: {}, buffer: {}/{}".format(
+        snap.captured, snap.saved, snap.dropped, snap.queue, snap.queue_max)
+    if snap.spilled:
+        text += " + {} spilled".format(snap.spilled)
+    text += ", {:.1f} fps kept, {:.1f} MB/s".format(snap.achieved_fps, snap.mb_per_s)
+    if snap.errors:
+        text += ", {} saving errors".format(snap.errors)
+    if snap.write_errors:
+        text += ", WARNING: {} frames not written".format(snap.write_errors)
+    return text
@@ -0,0 +1,315 @@
+# Description: One recording session (capture into the frame buffer, save from it), shared by the GUI threads and headless mode
+
+import os
+import time
+import queue
+import json
+import shutil
+import functools
+import threading
+from types import SimpleNamespace
+
+from capture_functions import grab_capture, fill_slot, DeviceTemperature
+from raw_session import RawSessionWriter, RAW_FMT, config_dict
+from frame_trace import TraceRecorder, now_ns
+from spill_buffer import SpillBuffer, SPILL_FILE
+from frame_manifest import ManifestWriter
+from device_calibration import save_calibration
+
+
+# what grab() does when the frame buffer is full
+#   stop:        give up on the frame, the saving thread ends the capture (the original behaviour)
+#   block:       wait for the saving thread to free a slot, the device drops frames meanwhile
+#   drop_oldest: overwrite the oldest frame waiting in the buffer
+#   drop_newest: give up on the new frame and keep capturing
+#   decimate:    halve the kept rate while the buffer is above the high-water mark, drop_newest when full
+BACKPRESSURE = ('stop', 'block', 'drop_oldest', 'drop_newest', 'decimate')
+SESSION_FILE = 'session.json'
+
+
+class CaptureSession:
+    """
+    Records one session from `device` into `saving_dir`.
+
+    grab() is called from the capture thread and save_next() from the saving
+    thread. Frames go through the frame buffer; image formats are encoded by the
+    encoder pool, the raw format is written directly by the saving thread.
+    With trace=True the stage times of every saved frame go to <saving_dir>/trace.raw.
+    Device timestamps, exposure, temperature and the drop counters of every
+    saved frame go to <saving_dir>/manifest.raw (see frame_manifest), the device
+    calibration to <saving_dir>/calibration.json.
+    A frame counts as saved, and gets its manifest row, once it is on disk;
+    frames the encoders failed to write are counted in write_errors.
+    A FrameScheduler picks which camera frames are kept, grab() never sleeps.
+    A full buffer is handled by the backpressure policy (see BACKPRESSURE), the
+    frames it drops are counted and written to <saving_dir>/session.json by close().
+    With spill_gb > 0, frames captured while more than spill_at of the buffer is
+    in use go to a SpillBuffer file of that size instead, until it is empty
+    again. New frames are dropped while the spill file is full ('block' waits,
+    'stop' ends the capture).
+    """
+    def __init__(self, device, frame_buffer, encoder_pool, saving_dir, fmt, config=None, trace=True, fsync=False,
+                 scheduler=None, backpressure='stop', high_water=0.75, spill_gb=0, spill_at=0.75, spill_dir=''):
+        if backpressure not in BACKPRESSURE:
+            raise ValueError("Unknown backpressure policy: " + str(backpressure))
+        self.device = device
+        self.temperature = DeviceTemperature(device)
+        self.scheduler = scheduler
+        self.frame_buffer = frame_buffer
+        self.encoder_pool = encoder_pool
+        self.saving_dir = saving_dir
+        self.fmt = fmt
+        self.config = config
+        self.raw_writer = None
+        self.manifest = None
+        self.trace_enabled = trace
+        self.trace = None
+        self.fsync = fsync
+        self.captured = 0
+        self.submitted = 0 # frames handed to the writers, numbers the Img_NNNN files
+        self.saved = 0 # frames on disk
+        self.write_errors = 0
+        self.last_error = None
+        self.written_lock = threading.Lock() # _written/_failed run on the encoder pool's callback thread or the saving thread
+        self.backpressure = backpressure
+        self.high_water_fraction = high_water
+        self.high_water = max(1, int(high_water * frame_buffer.maxsize)) # frames waiting before decimating
+        self.spill = None
+        self.spill_gb = spill_gb
+        self.spill_at = max(1, int(spill_at * frame_buffer.maxsize)) # frames waiting before spilling
+        self.spill_dir = spill_dir or saving_dir
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.stopping = False
+        self.overflowed = False # 'stop' gave up on a frame, the saving thread ends the capture
+        self.start_time = None
+        self.stop_time = None
+        self.frame_mb = frame_buffer.slots[0].nbytes / 2**20 # uncompressed size of one frame
+
+    def open(self):
+        # create the session folder, an existing one is replaced
+        if os.path.exists(self.saving_dir):
+            shutil.rmtree(self.saving_dir)
+        os.makedirs(self.saving_dir)
+        if self.fmt == RAW_FMT:
+            self.raw_writer = RawSessionWriter(self.saving_dir, self.frame_buffer, self.config,
+                                               extra={'geometry': self.frame_buffer.geometry})
+        else:
+            for stream in self.frame_buffer.streams:
+                os.makedirs(os.path.join(self.saving_dir, stream))
+        self.manifest = ManifestWriter(self.saving_dir, config=self.config)
+        save_calibration(self.saving_dir, getattr(self.device, 'calibration', None))
+        if self.trace_enabled:
+            self.trace = TraceRecorder(self.saving_dir)
+        if self.spill_gb > 0:
+            capacity = int(self.spill_gb * 2**30) // self.frame_buffer.stride
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.spill = SpillBuffer(self.frame_buffer, os.path.join(self.spill_dir, SPILL_FILE), capacity)
+            self.high_water = max(1, int(self.high_water_fraction * (self.frame_buffer.maxsize + capacity)))
+        self.start_time = time.perf_counter()
+        return self
+
+    def grab(self, timeout=0.1):
+        # capture one frame and commit it, None if nothing was captured
+        if self.backpressure == 'decimate' and self.scheduler is not None:
+            self.scheduler.decimation = 2 if self.backlog() > self.high_water else 1
+        frame = grab_capture(self.device, self.frame_buffer.geometry, self.scheduler, self.temperature)
+        if frame is None:
+            return None
+        spilling = self._spilling()
+        slot = self._spill_slot(timeout) if spilling else self._free_slot(timeout)
+        if slot is None:
+            self.dropped_newest += 1
+            return None
+        fill_slot(frame, slot)
+        self._stamp_counters(slot.meta)
+        if spilling:
+            self.spill.commit(slot)
+        else:
+            self.frame_buffer.commit(slot)
+        self.captured += 1
+        return slot
+
+    def _stamp_counters(self, meta):
+        # running totals at capture time, the manifest shows drop events as jumps between rows
+        if self.scheduler is not None:
+            meta['camera_frames'] = self.scheduler.seen
+            meta['missed_by_device'] = self.scheduler.missed
+            meta['decimated'] = self.scheduler.decimated
+        meta['dropped_oldest'] = self.dropped_oldest
+        meta['dropped_newest'] = self.dropped_newest
+
+    def _spilling(self):
+        # once frames are in the spill file the next ones follow them there, so they are saved in order
+        return self.spill is not None and (not self.spill.empty() or self.frame_buffer.in_use() >= self.spill_at)
+
+    def _spill_slot(self, timeout):
+        # a spill file slot, when the file is full only 'block' waits for one
+        slot = self.spill.acquire()
+        if self.backpressure == 'block':
+            while slot is None and not self.stopping:
+                time.sleep(min(timeout, 0.01))
+                slot = self.spill.acquire()
+        return slot
+
+    def _free_slot(self, timeout):
+        # a slot for the frame just captured, following the backpressure policy
+        slot = self.frame_buffer.acquire(timeout=0)
+        if slot is not None or self.backpressure in ('drop_newest', 'decimate'):
+            return slot
+        if self.backpressure == 'stop':
+            self.overflowed = True
+            return None
+        if self.backpressure == 'drop_oldest':
+            slot = self.frame_buffer.take_oldest()
+            if slot is not None:
+                self.dropped_oldest += 1
+                return slot
+            # every slot is with the encoders, wait for one
+        elif self.backpressure == 'block':
+            while slot is None and not self.stopping:
+                slot = self.frame_buffer.acquire(timeout=timeout)
+            return slot
+        return self.frame_buffer.acquire(timeout=timeout)
+
+    def request_stop(self):
+        # let a grab() blocked on a full buffer return
+        self.stopping = True
+        return self
+
+    def buffer_full(self):
+        # no free slot left, counting the frames the encoders are still writing
+        if self.spill is not None:
+            return self.spill.full()
+        return self.overflowed or self.frame_buffer.in_use() >= self.frame_buffer.maxsize
+
+    def backlog(self):
+        # frames captured but not written yet
+        return self.frame_buffer.in_use() + (self.spill.qsize() if self.spill is not None else 0)
+
+    def _next_frame(self, timeout):
+        # the oldest frame waiting, frames in the buffer are older than the spilled ones
+        if self.spill is None or self.spill.empty():
+            try:
+                return self.frame_buffer.get(timeout=timeout)
+            except queue.Empty:
+                return None
+        try:
+            return self.frame_buffer.get(timeout=0)
+        except queue.Empty:
+            pass
+        slot = self.frame_buffer.acquire(timeout=timeout)
+        if slot is not None and self.spill.get_into(slot) is None:
+            self.frame_buffer.release(slot)
+            return None
+        return slot
+
+    def save_next(self, timeout=0.1):
+        # save the oldest frame waiting, False if there was none within timeout
+        frame = self._next_frame(timeout)
+        if frame is None:
+            return False
+        index = self.submitted
+        self.submitted += 1
+
+        if self.raw_writer is not None:
+            # raw format, one copy per stream into the session files
+            encode_ns = now_ns() # nothing to encode
+            self.raw_writer.write(frame)
+            if self.fsync:
+                self.raw_writer.flush(fsync=True)
+            self._written(index, frame, (encode_ns, now_ns()))
+            self.frame_buffer.release(frame)
+        else:
+            # encode in the pool, the slot is released once its images are written
+            self.encoder_pool.submit(self.frame_buffer, frame,
+                                     dir=self.saving_dir,
+                                     name='Img_' + '{:04d}'.format(index),
+                                     fmt=self.fmt,
+                                     fsync=self.fsync,
+                                     on_written=functools.partial(self._written, index),
+                                     on_error=self._failed)
+        return True
+
+    def _written(self, index, slot, times):
+        # a frame reached the disk: count it, add its manifest row and complete its trace row
+        with self.written_lock:
+            self.manifest.record(slot.meta, index)
+            if self.trace is not None:
+                slot.trace['encode_ns'], slot.trace['write_ns'] = times
+                self.trace.record(slot.trace, slot.timestamp)
+            self.saved += 1
+
+    def _failed(self, slot, error):
+        # a frame the encoders could not write, it is missing from the session
+        with self.written_lock:
+            self.write_errors += 1
+            self.last_error = repr(error)
+
+    def drain(self, progress=None):
+        # save every frame still waiting in the buffer and the spill file, progress(frames left) after each one
+        while self.save_next(timeout=0 if self.spill is None else 0.1) or (self.spill is not None and not self.spill.empty()):
+            if progress is not None:
+                progress(self.backlog())
+        return self
+
+    def close(self):
+        # wait for the encoders and close the raw files, frames left in the buffer are not saved
+        self.stop_time = time.perf_counter()
+        self.encoder_pool.join()
+        if self.raw_writer is not None:
+            self.raw_writer.close()
+            self.raw_writer = None
+        if self.trace is not None:
+            self.trace.close()
+        self.manifest.close()
+        info = self.info()
+        if self.spill is not None:
+            self.spill.close()
+        with open(os.path.join(self.saving_dir, SESSION_FILE), 'w') as f:
+            json.dump(info, f, indent=2)
+        return self
+
+    def info(self):
+        # counters of the session, every camera frame is either saved or accounted for
+        scheduler = self.scheduler
+        return {
+            'fmt': self.fmt,
+            'streams': list(self.frame_buffer.streams),
+            'geometry': self.frame_buffer.geometry,
+            'serial': getattr(self.device, 'serial', ''),
+            'config': config_dict(self.config),
+            'backpressure': self.backpressure,
+            'high_water': self.high_water,
+            'elapsed': self.summary().elapsed,
+            'camera_frames': scheduler.seen if scheduler else None,
+            'missed_by_device': scheduler.missed if scheduler else None,
+            'skipped_by_scheduler': scheduler.seen - scheduler.picked if scheduler else None,
+            'decimated': scheduler.decimated if scheduler else 0,
+            'dropped_newest': self.dropped_newest,
+            'captured': self.captured,
+            'dropped_oldest': self.dropped_oldest,
+            'saved': self.saved,
+            'write_errors': self.write_errors, # frames the encoders failed to write
+            'last_error': self.last_error,
+            'not_saved': self.captured - self.dropped_oldest - self.saved - self.write_errors, # left in the buffer at close
+            'spilled': self.spill.total if self.spill else 0,
+            'spill_peak': self.spill.peak if self.spill else 0,
+            'spill_capacity': self.spill.capacity if self.spill else 0,
+            'requested_fps': scheduler.requested_fps if scheduler else None,
+            'achieved_fps': scheduler.achieved_fps if scheduler else None,
+        }
+
+    def summary(self):
+        end = self.stop_time if self.stop_time is not None else time.perf_counter()
+        elapsed = max(end - (self.start_time or end), 1e-9)
+        return SimpleNamespace(
+            elapsed=elapsed,
+            captured=self.captured,
+            saved=self.saved,
+            write_errors=self.write_errors,
+            dropped_oldest=self.dropped_oldest,
+            dropped_newest=self.dropped_newest,
+            capture_fps=self.captured / elapsed,
+            save_fps=self.saved / elapsed,
+            mb_per_s=self.saved * self.frame_mb / elapsed)
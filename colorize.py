@@ -0,0 +1,94 @@
+# Description: Depth/IR colorization for the preview, cached palettes applied into reusable buffers
+
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+
+COLORMAPS = ('turbo', 'jet', 'inferno', 'viridis', 'bone', 'gray')
+
+# value ranges shown from the first to the last palette color, the scaling the app has always used
+DEPTH_RANGE = (0, 5100) # millimetres, alpha 0.05
+IR_RANGE = (0, 2550)    # IR counts, alpha 0.10
+
+
+def make_palette(colormap, gamma=1.0):
+    # 256 RGB colors (a user colormap for cv2.applyColorMap), entry i shows fraction (i / 255) ** gamma of the range
+    ramp = np.round(np.linspace(0, 1, 256) ** gamma * 255).astype(np.uint8).reshape(256, 1)
+    if colormap == 'gray':
+        bgr = cv2.cvtColor(ramp, cv2.COLOR_GRAY2BGR)
+    else:
+        bgr = cv2.applyColorMap(ramp, getattr(cv2, 'COLORMAP_' + colormap.upper()))
+    return np.ascontiguousarray(bgr[..., ::-1]) # RGB, so the result needs no conversion
+
+
+class Colorizer:
+    """
+    Turns uint16 depth/IR images into RGB preview images in two passes and no
+    allocations: one saturating scale of [vmin, vmax] to 8 bits, one palette
+    lookup. The (scale, palette) table of each (colormap, vmin, vmax, gamma) is
+    made once and kept in an LRU of max_tables entries, so a tuned range costs
+    nothing per frame.
+
+    Results are written into a ring of n_buffers output buffers per image size,
+    a returned image stays valid until n_buffers more images of that size have
+    been colorized. The preview thread does not wait for the GUI, so the GUI
+    copies an image as soon as it takes it from the mailbox (update_image).
+    """
+    def __init__(self, max_tables=8, n_buffers=3):
+        self.max_tables = max_tables
+        self.n_buffers = n_buffers
+        self.tables = OrderedDict()
+        self.buffers = {}
+        self.lock = threading.Lock()
+        self.settings = {
+            'Depth': ('turbo',) + DEPTH_RANGE + (1.0,),
+            'IR': ('gray',) + IR_RANGE + (1.0,),
+        }
+
+    def table(self, colormap, vmin, vmax, gamma=1.0):
+        key = (colormap, vmin, vmax, gamma)
+        with self.lock:
+            if key in self.tables:
+                self.tables.move_to_end(key)
+                return self.tables[key]
+        entry = (255.0 / max(vmax - vmin, 1), make_palette(colormap, gamma))
+        with self.lock:
+            self.tables[key] = entry
+            while len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False) # least recently used
+        return entry
+
+    def _buffers(self, hw):
+        # next (scaled, shifted, out) buffers of the ring for this image size
+        with self.lock:
+            ring = self.buffers.get(hw)
+            if ring is None:
+                ring = self.buffers[hw] = [[(np.empty(hw, np.uint8), np.empty(hw, np.uint16),
+                                             np.empty(hw + (3,), np.uint8)) for _ in range(self.n_buffers)], 0]
+            buffers = ring[0][ring[1]]
+            ring[1] = (ring[1] + 1) % self.n_buffers
+        return buffers
+
+    def __call__(self, image, colormap='turbo', vmin=DEPTH_RANGE[0], vmax=DEPTH_RANGE[1], gamma=1.0):
+        alpha, palette = self.table(colormap, vmin, vmax, gamma)
+        scaled, shifted, out = self._buffers(image.shape[:2])
+        if vmin > 0:
+            image = cv2.subtract(image, vmin, dst=shifted) # saturates at 0, values below vmin get the first color
+        cv2.convertScaleAbs(image, dst=scaled, alpha=alpha)
+        cv2.applyColorMap(scaled, palette, dst=out)
+        return out
+
+    def configure(self, view, colormap=None, vmin=None, vmax=None, gamma=None):
+        # change how a view ('Depth' or 'IR') is colored, None keeps the current value
+        current = self.settings[view]
+        self.settings[view] = tuple(new if new is not None else old
+                                    for new, old in zip((colormap, vmin, vmax, gamma), current))
+        return self
+
+    def view(self, image, view):
+        return self(image, *self.settings[view])
+
+
+COLORIZER = Colorizer() # shared by the preview threads
@@ -0,0 +1,182 @@
+# Description: Device calibration as plain json (intrinsics, distortion, depth to color extrinsics), saved with every session,
+# and the per-pixel tables derived from it, cached on disk per device and mode
+
+import os
+import glob
+import json
+import cv2
+import numpy as np
+import pyk4a
+from pyk4a.calibration import CalibrationType
+
+from frame_buffer import color_shape, depth_shape
+
+
+CALIBRATION_FILE = 'calibration.json'
+CALIBRATION_DIR = os.path.join(os.path.expanduser('~'), '.myK4a', 'calibration')
+CAMERAS = (('depth', CalibrationType.DEPTH), ('color', CalibrationType.COLOR))
+
+# nominal (horizontal, vertical) field of view in degrees, for sources without a factory calibration
+DEPTH_FOV = {
+    pyk4a.DepthMode.NFOV_2X2BINNED: (75, 65),
+    pyk4a.DepthMode.NFOV_UNBINNED: (75, 65),
+    pyk4a.DepthMode.WFOV_2X2BINNED: (120, 120),
+    pyk4a.DepthMode.WFOV_UNBINNED: (120, 120),
+    pyk4a.DepthMode.PASSIVE_IR: (120, 120),
+}
+COLOR_FOV = (90, 59) # 16:9 resolutions
+COLOR_FOV_4_3 = (90, 74.3) # 1536P and 3072P
+
+
+def calibration_dict(calibration):
+    # pyk4a Calibration as {'raw', 'depth', 'color', 'depth_to_color'}, lists only; a dict is returned as it is
+    if calibration is None or isinstance(calibration, dict):
+        return calibration
+    out = {'raw': calibration.calibration_raw}
+    for camera, kind in CAMERAS:
+        out[camera] = {
+            'matrix': np.asarray(calibration.get_camera_matrix(kind)).tolist(),
+            'distortion': np.asarray(calibration.get_distortion_coefficients(kind)).ravel().tolist(),
+        }
+    # pyk4a (1.5) returns the translation in metres (the SDK's millimetres / 1000), depth is in millimetres
+    rotation, translation = calibration.get_extrinsic_parameters(CalibrationType.DEPTH, CalibrationType.COLOR)
+    out['depth_to_color'] = {
+        'rotation': np.asarray(rotation).reshape(3, 3).tolist(),
+        'translation': (np.asarray(translation, dtype=np.float64).ravel() * 1000).tolist(),
+        'unit': 'mm',
+    }
+    return out
+
+def extrinsics(calibration):
+    # (3x3 rotation, translation in millimetres) from the depth to the color camera as float64 arrays;
+    # calibrations saved without a 'unit' hold the translation in metres, as pyk4a returns it
+    params = calibration['depth_to_color']
+    translation = np.array(params['translation'], dtype=np.float64).ravel()
+    if params.get('unit', 'm') == 'm':
+        translation *= 1000
+    return np.array(params['rotation'], dtype=np.float64).reshape(3, 3), translation
+
+def pinhole(hw, fov_deg):
+    # camera matrix of an ideal camera of size hw with the given (horizontal, vertical) field of view
+    h, w = hw
+    fx = w / 2 / np.tan(np.radians(fov_deg[0]) / 2)
+    fy = h / 2 / np.tan(np.radians(fov_deg[1]) / 2)
+    return [[fx, 0, (w - 1) / 2], [0, fy, (h - 1) / 2], [0, 0, 1]]
+
+def nominal_calibration(config):
+    # datasheet fields of view, no distortion and no offset between the cameras (synthetic frames)
+    chw = color_shape(config)
+    color_fov = COLOR_FOV if chw[1] * 9 == chw[0] * 16 else COLOR_FOV_4_3
+    return {
+        'raw': None,
+        'nominal': True,
+        'depth': {'matrix': pinhole(depth_shape(config), DEPTH_FOV[pyk4a.DepthMode(config.depth_mode)]), 'distortion': [0.0] * 8},
+        'color': {'matrix': pinhole(chw, color_fov), 'distortion': [0.0] * 8},
+        'depth_to_color': {'rotation': np.eye(3).tolist(), 'translation': [0.0, 0.0, 0.0], 'unit': 'mm'},
+    }
+
+def intrinsics(calibration, camera):
+    # (3x3 camera matrix, distortion coefficients k1 k2 p1 p2 k3 k4 k5 k6) as float64 arrays, OpenCV order
+    params = calibration[camera]
+    return np.array(params['matrix'], dtype=np.float64), np.array(params['distortion'], dtype=np.float64)
+
+def ray_table(matrix, distortion, hw):
+    # (h, w, 2) float32 of x/z, y/z for every pixel, a point is then ray * depth
+    h, w = hw
+    v, u = np.mgrid[0:h, 0:w].astype(np.float32)
+    pixels = np.stack((u, v), axis=-1).reshape(-1, 1, 2)
+    if np.any(distortion):
+        criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 20, 1e-6)
+        if hasattr(cv2, 'undistortPointsIter'): # OpenCV 4, 5 takes the criteria in undistortPoints
+            rays = cv2.undistortPointsIter(pixels, matrix, distortion, None, None, criteria)
+        else:
+            rays = cv2.undistortPoints(pixels, matrix, distortion, R=None, P=None, criteria=criteria)
+    else:
+        rays = (pixels - matrix[[0, 1], [2, 2]]) / matrix[[0, 1], [0, 1]]
+    return np.ascontiguousarray(rays.reshape(h, w, 2), dtype=np.float32)
+
+def save_calibration(session_dir, calibration):
+    # <session>/calibration.json, nothing is written without a calibration
+    calibration = calibration_dict(calibration)
+    if calibration is None:
+        return None
+    path = os.path.join(session_dir, CALIBRATION_FILE)
+    with open(path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    return path
+
+def load_calibration(session_dir):
+    # the calibration dict saved with a session, None for sessions saved before it existed
+    path = os.path.join(session_dir, CALIBRATION_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def table_key(serial, config):
+    # cache folder name of a device and mode, e.g. 000123_RES_1080P_NFOV_UNBINNED
+    return "{}_{}_{}".format(serial or 'unknown', pyk4a.ColorResolution(config.color_resolution).name,
+                             pyk4a.DepthMode(config.depth_mode).name)
+
+
+class CalibrationTables:
+    """
+    Per-pixel tables of one device in one mode, for the depth and color cameras:
+    rays (see ray_table) and the cv2.initUndistortRectifyMap maps (map1, map2,
+    fixed point, for cv2.remap). A table is built on first use and saved to
+    <cache_dir>/<table_key>/<camera>_<table>.npy, later runs memory map it. The
+    cache is rebuilt when the device calibration no longer matches the one
+    saved with it.
+    """
+    TABLES = ('rays', 'map1', 'map2')
+
+    def __init__(self, cache_dir, serial, config, calibration):
+        self.calibration = calibration_dict(calibration)
+        self.dir = os.path.join(cache_dir, table_key(serial, config))
+        self.shapes = {'depth': depth_shape(config), 'color': color_shape(config)}
+        self.tables = {}
+        self.built = 0
+        self.loaded = 0
+        os.makedirs(self.dir, exist_ok=True)
+        if load_calibration(self.dir) != self.calibration:
+            for path in glob.glob(os.path.join(self.dir, '*.npy')):
+                os.remove(path)
+            save_calibration(self.dir, self.calibration)
+
+    def load(self):
+        # every table of both cameras, building the missing ones
+        for camera, kind in CAMERAS:
+            for name in self.TABLES:
+                self.table(camera, name)
+        return self
+
+    def table(self, camera, name):
+        if (camera, name) not in self.tables:
+            path = os.path.join(self.dir, camera + '_' + name + '.npy')
+            if os.path.exists(path):
+                self.tables[camera, name] = np.load(path, mmap_mode='r')
+                self.loaded += 1
+            else:
+                self._build(camera)
+        return self.tables[camera, name]
+
+    def _build(self, camera):
+        matrix, distortion = intrinsics(self.calibration, camera)
+        h, w = self.shapes[camera]
+        map1, map2 = cv2.initUndistortRectifyMap(matrix, distortion, None, matrix, (w, h), cv2.CV_16SC2)
+        for name, table in (('rays', ray_table(matrix, distortion, (h, w))), ('map1', map1), ('map2', map2)):
+            # written under a temporary name, so another process never maps half a table
+            path = os.path.join(self.dir, camera + '_' + name + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, table)
+            os.replace(path + '.tmp', path)
+            self.tables[camera, name] = table
+        self.built += 1
+
+    def rays(self, camera):
+        return self.table(camera, 'rays')
+
+    def undistort(self, image, camera, interpolation=cv2.INTER_LINEAR):
+        # image of the camera without lens distortion, same camera matrix (use INTER_NEAREST for depth)
+        return cv2.remap(image, self.table(camera, 'map1'), self.table(camera, 'map2'), interpolation)
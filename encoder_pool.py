@@ -0,0 +1,128 @@
+# Description: Pool of worker processes that encode and write frames from a shared memory frame buffer
+
+import os
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+from frame_buffer import slot_arrays
+from capture_functions import save_data
+
+"""
+------------------------------------------------------------------------------------------------------------------------
+Worker side
+------------------------------------------------------------------------------------------------------------------------
+"""
+
+# shared memory blocks attached by this worker, name -> SharedMemory
+_attached = collections.OrderedDict()
+_max_attached = 16 # one frame buffer per device of a multi-device capture
+
+def _attach(shm_name):
+    shm = _attached.get(shm_name)
+    if shm is None:
+        # workers share the parent's resource tracker, the parent unlinks the block
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _attached[shm_name] = shm
+        # forget buffers that were replaced by a new config
+        while len(_attached) > _max_attached:
+            _attached.popitem(last=False)[1].close()
+    return shm
+
+def encode_slot(shm_name, layout, stride, index, dir, name, fmt, fsync=False):
+    arrays = slot_arrays(_attach(shm_name).buf, layout, stride, index)
+    times = save_data(SimpleNamespace(**arrays), dir, name, fmt, fsync)
+    del arrays
+    return times
+
+"""
+------------------------------------------------------------------------------------------------------------------------
+Main process side
+------------------------------------------------------------------------------------------------------------------------
+"""
+
+def default_workers():
+    return max(1, (os.cpu_count() or 2) // 2)
+
+class EncoderPool:
+    """
+    Encodes frame slots in n_workers processes. A slot is released back to its
+    frame buffer as soon as its images are written. File names are chosen by the
+    caller, so the Img_NNNN ordering does not depend on which worker finishes first.
+    submit() waits while every worker is busy: frames not being encoded stay
+    committed in the frame buffer, where the backpressure policy can see them.
+    Frames that could not be written are counted in errors.
+    With n_workers=0 the frames are written inline on the calling thread.
+    """
+    def __init__(self, n_workers=None):
+        self.n_workers = default_workers() if n_workers is None else n_workers
+        self.executor = None
+        if self.n_workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        self.pending = set()
+        self.finished = threading.Condition() # notified when a frame left pending, after its callbacks ran
+        self.idle = threading.Semaphore(max(1, self.n_workers)) # one frame per worker at a time
+        self.errors = 0
+
+    def submit(self, frame_buffer, slot, dir, name, fmt, fsync=False, on_written=None, on_error=None):
+        # on_written(slot, (encode_ns, write_ns)) is called before the slot is released,
+        # on_error(slot, exception) instead when the frame could not be written
+        if self.executor is None or frame_buffer.shm_name is None:
+            try:
+                times = save_data(slot, dir, name, fmt, fsync)
+            except Exception as e:
+                self._failed(slot, e, on_error)
+            else:
+                if on_written is not None:
+                    on_written(slot, times)
+            finally:
+                frame_buffer.release(slot)
+            return None
+
+        self.idle.acquire()
+        try:
+            future = self.executor.submit(encode_slot, frame_buffer.shm_name, frame_buffer.layout,
+                                          frame_buffer.stride, slot.index, dir, name, fmt, fsync)
+        except BaseException:
+            self.idle.release()
+            raise
+        with self.finished:
+            self.pending.add(future)
+
+        def done(f):
+            self.idle.release()
+            try:
+                if f.exception() is not None:
+                    self._failed(slot, f.exception(), on_error)
+                elif on_written is not None:
+                    on_written(slot, f.result())
+            finally:
+                frame_buffer.release(slot)
+                with self.finished:
+                    self.pending.discard(f)
+                    self.finished.notify_all()
+        future.add_done_callback(done)
+        return future
+
+    def _failed(self, slot, error, on_error):
+        self.errors += 1
+        if on_error is not None:
+            on_error(slot, error)
+
+    def in_flight(self):
+        return len(self.pending)
+
+    def join(self, timeout=None):
+        # wait until every submitted frame is on disk and its callbacks have run
+        with self.finished: # several saving threads may be submitting
+            self.finished.wait_for(lambda: not self.pending, timeout=timeout)
+        return self
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.join()
+            self.executor.shutdown()
+            self.executor = None
+        return self
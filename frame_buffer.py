@@ -0,0 +1,254 @@
+# Description: Preallocated ring buffer of frame slots shared by the capture and saving threads
+
+import os
+import sys
+import queue
+from multiprocessing import shared_memory
+import numpy as np
+import pyk4a
+
+from frame_trace import TRACE_DTYPE, now_ns
+from frame_manifest import MANIFEST_DTYPE
+
+
+# (height, width) of the color camera for each color resolution
+COLOR_SHAPES = {
+    pyk4a.ColorResolution.RES_720P: (720, 1280),
+    pyk4a.ColorResolution.RES_1080P: (1080, 1920),
+    pyk4a.ColorResolution.RES_1440P: (1440, 2560),
+    pyk4a.ColorResolution.RES_1536P: (1536, 2048),
+    pyk4a.ColorResolution.RES_2160P: (2160, 3840),
+    pyk4a.ColorResolution.RES_3072P: (3072, 4096),
+}
+
+# (height, width) of the depth and IR cameras for each depth mode
+DEPTH_SHAPES = {
+    pyk4a.DepthMode.NFOV_2X2BINNED: (288, 320),
+    pyk4a.DepthMode.NFOV_UNBINNED: (576, 640),
+    pyk4a.DepthMode.WFOV_2X2BINNED: (512, 512),
+    pyk4a.DepthMode.WFOV_UNBINNED: (1024, 1024),
+    pyk4a.DepthMode.PASSIVE_IR: (1024, 1024),
+}
+
+COLOR_CHANNELS = 4 # BGRA32, the only color format the app saves
+
+STREAMS = ('rgb', 'depth', 'ir')
+GEOMETRIES = ('color', 'native') # depth/IR transformed to the color camera, or as the depth camera sees them
+
+
+def color_shape(config):
+    return COLOR_SHAPES[pyk4a.ColorResolution(config.color_resolution)]
+
+def depth_shape(config):
+    return DEPTH_SHAPES[pyk4a.DepthMode(config.depth_mode)]
+
+
+def available_memory():
+    # bytes of physical memory that can still be allocated, None if unknown
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    if os.path.exists('/proc/meminfo'):
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    return None
+
+
+def shared_memory_free():
+    # bytes still free for shared memory blocks, None if they are not limited on their own (they live in /dev/shm
+    # on Linux, a tmpfs often much smaller than the RAM; Windows backs them with the page file)
+    if os.path.isdir('/dev/shm'):
+        stat = os.statvfs('/dev/shm')
+        return stat.f_bavail * stat.f_frsize
+    return None
+
+
+def slot_layout(color_hw, depth_hw, depth_dtype, streams=STREAMS):
+    # byte layout of one slot: [(stream, shape, dtype, offset), ...] and the slot stride
+    layout = []
+    offset = 0
+    for name, shape, dtype in (('rgb', color_hw + (COLOR_CHANNELS,), 'uint8'),
+                               ('depth', depth_hw, np.dtype(depth_dtype).str),
+                               ('ir', depth_hw, np.dtype(depth_dtype).str)):
+        if name not in streams:
+            continue
+        layout.append((name, tuple(shape), dtype, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    stride = (offset + 63) // 64 * 64 # keep every slot 64-byte aligned
+    return layout, stride
+
+def slot_arrays(buf, layout, stride, index):
+    # numpy views of slot `index` inside a flat buffer, no copy
+    arrays = {}
+    for name, shape, dtype, offset in layout:
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=index * stride + offset)
+    return arrays
+
+
+class FrameSlot:
+    # one preallocated frame, filled in place by the capture thread, disabled streams are None
+    def __init__(self, index, arrays):
+        self.index = index
+        self.streams = tuple(arrays)
+        self.rgb = arrays.get('rgb')
+        self.depth = arrays.get('depth')
+        self.ir = arrays.get('ir')
+        self.timestamp = 0 # device timestamp of the color image (usec)
+        self.seq = -1 # sequence number given when the slot is committed
+        self.trace = np.zeros((), dtype=TRACE_DTYPE) # stage times of the frame in this slot
+        self.meta = np.zeros((), dtype=MANIFEST_DTYPE) # its manifest row
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.streams)
+
+
+class FrameBuffer:
+    """
+    Fixed-capacity ring of frame slots sized from a pyk4a Config.
+
+    The capture thread takes a free slot with acquire(), fills it and hands it
+    over with commit(). The saving thread takes committed slots in order with
+    get() and gives them back with release() once they are written.
+
+    With shared=True all slots live in one multiprocessing shared memory block,
+    so encoder processes can read a slot from (shm_name, layout, stride, index)
+    without the arrays being pickled. If the block does not fit in the free
+    shared memory the slots are private (shm_name is None) and the encoder
+    pool writes the frames inline.
+    """
+    def __init__(self, config, capacity, depth_dtype=np.uint8, shared=False, streams=STREAMS, geometry='color'):
+        if geometry not in GEOMETRIES:
+            raise ValueError("Unknown geometry: " + str(geometry))
+        self.config = config
+        self.maxsize = capacity
+        self.depth_dtype = np.dtype(depth_dtype)
+        self.streams = tuple(name for name in STREAMS if name in streams)
+        self.geometry = geometry
+        hw = color_shape(config)
+        depth_hw = hw if geometry == 'color' else depth_shape(config)
+        self.layout, self.stride = slot_layout(hw, depth_hw, depth_dtype, self.streams)
+
+        self.shm = None
+        self.shm_name = None
+        free = shared_memory_free() if shared else None
+        if free is not None and self.stride * capacity > free:
+            # a block larger than /dev/shm is created sparse and the process dies of SIGBUS once it fills up
+            print("Not enough shared memory for {} frames ({:.0f} MB needed, {:.0f} MB free in /dev/shm), "
+                  "frames are encoded on the saving thread".format(capacity, self.stride * capacity / 2**20, free / 2**20))
+            shared = False
+        if shared:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.stride * capacity)
+            self.shm_name = self.shm.name
+            buf = self.shm.buf
+        else:
+            buf = np.zeros(self.stride * capacity, dtype=np.uint8)
+        self.slots = [FrameSlot(i, slot_arrays(buf, self.layout, self.stride, i)) for i in range(capacity)]
+        self.seq = 0
+
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for slot in self.slots:
+            self._free.put(slot)
+
+    def prefault(self):
+        # write every page once, so capturing into a large buffer does not pay for the page faults
+        for slot in self.slots:
+            for name in self.streams:
+                getattr(slot, name).fill(0)
+        return self
+
+    def matches(self, config, depth_dtype, streams, geometry):
+        # True if the slots fit frames captured with these settings
+        return (self.config == config and self.depth_dtype == np.dtype(depth_dtype)
+                and self.streams == tuple(name for name in STREAMS if name in streams)
+                and self.geometry == geometry)
+
+    def acquire(self, timeout=None):
+        # get a free slot, None if there is none within timeout
+        try:
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stamp(self, slot):
+        # give a captured frame the next sequence number (also used for frames that go to the spill file)
+        slot.seq = self.seq
+        self.seq += 1
+        slot.trace['seq'] = slot.seq
+        slot.meta['seq'] = slot.seq
+        slot.trace['enqueue_ns'] = now_ns()
+
+    def commit(self, slot):
+        self.stamp(slot)
+        self._ready.put(slot)
+
+    def discard(self, slot):
+        # give back a slot that was acquired but never committed
+        self._free.put(slot)
+
+    def take_oldest(self):
+        # take back the oldest committed slot without saving it (drop-oldest), None if nothing is waiting
+        try:
+            return self._ready.get_nowait()
+        except queue.Empty:
+            return None
+
+    def get(self, timeout=None):
+        # get the oldest committed slot, raises queue.Empty on timeout
+        slot = self._ready.get(timeout=timeout)
+        slot.trace['dequeue_ns'] = now_ns()
+        return slot
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def qsize(self):
+        return self._ready.qsize()
+
+    def in_use(self):
+        # slots not free: committed ones and those still being written
+        return self.maxsize - self._free.qsize()
+
+    def empty(self):
+        return self._ready.empty()
+
+    def clear(self):
+        # drop every committed slot without saving it
+        while True:
+            try:
+                self._free.put(self._ready.get_nowait())
+            except queue.Empty:
+                break
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(slot.nbytes for slot in self.slots)
+
+    def close(self):
+        # free the shared memory block, the buffer cannot be used afterwards
+        self.slots = []
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
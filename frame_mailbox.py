@@ -0,0 +1,61 @@
+# Description: Latest-frame-wins handoff of preview frames from the worker threads to the GUI thread
+
+import time
+import threading
+
+
+class FrameMailbox:
+    """
+    Holds at most one preview frame. put() replaces a frame the GUI has not
+    taken yet (counted in coalesced) and returns True only when the mailbox
+    was empty, so the worker emits one signal per frame the GUI can show and
+    signals never pile up in the Qt event queue.
+
+    due() caps the display rate at max_fps (0 for no cap); frames it turns
+    down are counted in skipped and should not even be converted.
+    """
+    def __init__(self, max_fps=0):
+        self.period = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.next_due = 0.0
+        self.frame = None
+        self.lock = threading.Lock()
+        self.posted = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.shown = 0
+
+    def due(self):
+        now = time.perf_counter()
+        if now < self.next_due:
+            self.skipped += 1
+            return False
+        # stay on the period grid, unless the worker fell more than a period behind
+        self.next_due = max(self.next_due + self.period, now)
+        return True
+
+    def put(self, frame):
+        with self.lock:
+            self.posted += 1
+            empty = self.frame is None
+            if not empty:
+                self.coalesced += 1
+            self.frame = frame
+        return empty
+
+    def take(self):
+        # the newest frame, None if it was already taken
+        with self.lock:
+            frame, self.frame = self.frame, None
+        if frame is not None:
+            self.shown += 1
+        return frame
+
+    def clear(self):
+        with self.lock:
+            self.frame = None
+        return self
+
+    def summary_text(self):
+        return "{} shown, {} coalesced, {} skipped by the {} cap".format(
+            self.shown, self.coalesced, self.skipped,
+            "{:.0f} fps".format(1.0 / self.period) if self.period else "no")
@@ -0,0 +1,82 @@
+# Description: Per-frame manifest of a session (timestamps, exposure, temperature, sequence and drop counters)
+
+import os
+import threading
+import numpy as np
+
+from raw_session import RawStreamWriter, open_stream, RAW_FMT
+
+
+MANIFEST_FILE = 'manifest' + RAW_FMT
+
+# one fixed-width row per saved frame, in the order the frames reached the disk
+MANIFEST_DTYPE = np.dtype([
+    ('index', '<i8'),                   # Img_NNNN number, or frame number in the raw files
+    ('seq', '<i8'),                     # frame buffer sequence number, gaps are frames dropped after capture
+    ('device_ts_usec', '<i8'),          # device timestamps of the images
+    ('depth_ts_usec', '<i8'),
+    ('ir_ts_usec', '<i8'),
+    ('system_ts_nsec', '<i8'),          # host time the color image arrived (0 if unknown)
+    ('capture_ns', '<i8'),              # time.perf_counter_ns() when get_capture returned
+    ('exposure_usec', '<i8'),           # color exposure (0 if unknown)
+    ('white_balance', '<i4'),           # color white balance in kelvin (0 if unknown)
+    ('temperature', '<f4'),             # device temperature in degrees C from the IMU, read once a second (nan if unknown)
+    ('camera_frames', '<i8'),           # totals when the frame was captured, a jump between rows is a drop event:
+    ('missed_by_device', '<i8'),        #   frames the device never delivered
+    ('decimated', '<i8'),               #   frames skipped by the decimate policy
+    ('dropped_oldest', '<i8'),          #   frames overwritten in the buffer
+    ('dropped_newest', '<i8'),          #   frames given up because the buffer was full
+])
+
+
+class ManifestWriter:
+    """
+    Appends MANIFEST_DTYPE rows to <session>/manifest.raw. Rows are collected
+    in a preallocated batch and written batch_size at a time, and by flush().
+    Rows come from the saving thread or the callbacks of the encoder pool,
+    record() and flush() hold a lock.
+    """
+    def __init__(self, session_dir, batch_size=256, config=None):
+        self.path = os.path.join(session_dir, MANIFEST_FILE)
+        self.writer = RawStreamWriter(self.path, (), MANIFEST_DTYPE, config)
+        self.batch = np.zeros(batch_size, dtype=MANIFEST_DTYPE)
+        self.n_batch = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, row, index):
+        with self.lock:
+            self.batch[self.n_batch] = row
+            self.batch['index'][self.n_batch] = index
+            self.n_batch += 1
+            self.count += 1
+            if self.n_batch == len(self.batch):
+                self._flush()
+
+    def _flush(self):
+        if self.n_batch:
+            self.writer.write(self.batch[:self.n_batch])
+            self.n_batch = 0
+
+    def flush(self, fsync=False):
+        with self.lock:
+            self._flush()
+            self.writer.flush(fsync)
+        return self
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        return self
+
+
+def load_manifest(path, pandas=False):
+    # all rows in index order as a structured array (columns by name), or a pandas DataFrame
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_FILE)
+    rows = np.array(open_stream(path))
+    rows = rows[np.argsort(rows['index'], kind='stable')] # the encoders finish out of order
+    if pandas:
+        import pandas as pd
+        return pd.DataFrame(rows)
+    return rows
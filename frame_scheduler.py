@@ -0,0 +1,117 @@
+# Description: Decimates captures by their device timestamps instead of sleeping between frames
+
+import math
+import threading
+
+
+class SyncGrid:
+    """
+    Time origin shared by the schedulers of devices in wired sync. The first
+    frame any of them sees sets t0, so every device keeps the frames of the
+    same targets, whenever its own first frame arrived.
+    """
+    def __init__(self):
+        self.t0 = None
+        self.lock = threading.Lock()
+
+    def origin(self, timestamp_usec):
+        with self.lock:
+            if self.t0 is None:
+                self.t0 = timestamp_usec
+            return self.t0
+
+
+class FrameScheduler:
+    """
+    Decides which captures are kept, from the device timestamps only.
+
+    every_n > 0 keeps every n-th frame. Otherwise the frame closest to each
+    target time t0 + k * period is kept; the targets stay on that grid, so the
+    kept rate does not drift however long the capture thread takes per frame.
+    A period shorter than one camera frame keeps every frame.
+
+    decimation > 1 keeps only every decimation-th of the frames picked above
+    (set by the decimate backpressure policy). Camera frames that never reached
+    keep(), found from gaps in the timestamps, are counted in missed.
+
+    With a SyncGrid, t0 and the frame count of every_n come from the grid
+    instead of this device's first frame; offset_usec (the subordinate delay)
+    is taken off the timestamps first, to put them on the master's clock.
+    """
+    def __init__(self, camera_fps, period_ms=0, every_n=0, grid=None, offset_usec=0):
+        self.camera_fps = camera_fps
+        self.grid = grid
+        self.offset_usec = offset_usec
+        self.frame_usec = 1e6 / camera_fps
+        self.every_n = max(int(every_n), 0)
+        self.period_usec = max(period_ms * 1000, self.frame_usec)
+        self.next_target = None
+        self.seen = 0
+        self.kept = 0
+        self.decimation = 1
+        self.picked = 0
+        self.decimated = 0
+        self.missed = 0
+        self.last_seen = None
+        self.first_ts = None
+        self.last_ts = None
+
+    @property
+    def requested_fps(self):
+        if self.every_n:
+            return self.camera_fps / self.every_n
+        return 1e6 / self.period_usec
+
+    @property
+    def achieved_fps(self):
+        # kept frames per second of device time
+        if self.kept < 2 or self.last_ts == self.first_ts:
+            return 0.0
+        return (self.kept - 1) * 1e6 / (self.last_ts - self.first_ts)
+
+    def keep(self, timestamp_usec):
+        self.seen += 1
+        if self.last_seen is not None:
+            self.missed += max(int(round((timestamp_usec - self.last_seen) / self.frame_usec)) - 1, 0)
+        self.last_seen = timestamp_usec
+        t = timestamp_usec - self.offset_usec
+        if self.every_n:
+            if self.grid is None:
+                keep = (self.seen - 1) % self.every_n == 0
+            else:
+                keep = int(round((t - self.grid.origin(t)) / self.frame_usec)) % self.every_n == 0
+        else:
+            half_frame = self.frame_usec / 2
+            if self.next_target is None:
+                self.next_target = t
+                if self.grid is not None:
+                    # the first target of the shared grid this frame can still be the closest to
+                    t0 = self.grid.origin(t)
+                    self.next_target = t0 + math.ceil((t - half_frame - t0) / self.period_usec) * self.period_usec
+            keep = t >= self.next_target - half_frame
+            if keep:
+                # move to the first target this frame cannot be the closest to (skips targets lost to dropped frames)
+                while self.next_target - half_frame <= t:
+                    self.next_target += self.period_usec
+
+        if keep:
+            self.picked += 1
+            if self.decimation > 1 and (self.picked - 1) % self.decimation:
+                self.decimated += 1
+                keep = False
+
+        if keep:
+            self.kept += 1
+            if self.first_ts is None:
+                self.first_ts = timestamp_usec
+            self.last_ts = timestamp_usec
+        return keep
+
+    def summary_text(self):
+        text = "achieved {:.2f} fps of {:.2f} requested ({} of {} camera frames kept".format(
+            self.achieved_fps, self.requested_fps, self.kept, self.seen)
+        if self.decimated:
+            text += ", {} decimated".format(self.decimated)
+        if self.missed:
+            text += ", {} missed by the device".format(self.missed)
+        return text + ")"
@@ -0,0 +1,238 @@
+# Description: Frame sources behind connect_device: the Azure Kinect, a synthetic generator and a session replay
+# Every source has start(), stop(), get_capture(), serial, calibration and _config (the Config its frames follow,
+# a replay takes it from the session), and its captures look like pyk4a captures (color, depth, ir, transformed_depth,
+# transformed_ir and the *_timestamp_usec fields).
+
+import os
+import glob
+import time
+import cv2
+import numpy as np
+import pyk4a
+from pyk4a import PyK4A
+
+from frame_buffer import color_shape, depth_shape, COLOR_CHANNELS, COLOR_SHAPES, DEPTH_SHAPES, STREAMS
+from session_reader import Session
+from capture_pipeline import SESSION_FILE
+from raw_session import config_from_dict
+from device_calibration import nominal_calibration
+
+
+SOURCES = ('k4a', 'synthetic', 'replay')
+
+FPS_RATES = {
+    pyk4a.FPS.FPS_5: 5,
+    pyk4a.FPS.FPS_15: 15,
+    pyk4a.FPS.FPS_30: 30,
+}
+
+def camera_rate(config):
+    return FPS_RATES[pyk4a.FPS(config.camera_fps)]
+
+
+class SourceCapture:
+    # capture built from arrays, transformed_* are resized to the color geometry on first use
+    def __init__(self, color, depth, ir, timestamp_usec, transformed=None):
+        self.color = color
+        self.depth = depth
+        self.ir = ir
+        self.color_timestamp_usec = timestamp_usec
+        self.depth_timestamp_usec = timestamp_usec
+        self.ir_timestamp_usec = timestamp_usec
+        self._transformed = dict(transformed or {})
+
+    def _transform(self, name, image):
+        if name not in self._transformed:
+            h, w = self.color.shape[:2]
+            self._transformed[name] = cv2.resize(image, (w, h), interpolation=cv2.INTER_NEAREST)
+        return self._transformed[name]
+
+    @property
+    def transformed_depth(self):
+        return self._transform('depth', self.depth)
+
+    @property
+    def transformed_ir(self):
+        return self._transform('ir', self.ir)
+
+
+class PacedSource:
+    # common pacing and bookkeeping for the sources that are not a real device
+    serial = ""
+    calibration = None
+
+    def __init__(self, config, fps=None):
+        self._config = config
+        self.fps = fps if fps else camera_rate(config)
+        self.frame_index = 0
+        self._start_time = None
+
+    def start(self):
+        # the clock starts with the first get_capture, like a device delivers nothing before it is read
+        self.frame_index = 0
+        self._start_time = None
+        return self
+
+    def stop(self):
+        self._start_time = None
+        return self
+
+    def _wait(self):
+        # block until the next frame is due, like a camera at self.fps; when the reader fell behind, the frames
+        # whose time passed are skipped like a device drops them, so the lag shows as gaps in the timestamps
+        now = time.perf_counter()
+        if self._start_time is None:
+            self._start_time = now
+        due = self._start_time + self.frame_index / self.fps
+        if due > now:
+            time.sleep(due - now)
+        else:
+            self.frame_index = max(self.frame_index, int(round((now - self._start_time) * self.fps)))
+
+    def _timestamp(self):
+        return int(self.frame_index * 1e6 / self.fps)
+
+    def get_capture(self):
+        self._wait()
+        capture = self._make_capture()
+        self.frame_index += 1
+        return capture
+
+
+class SyntheticSource(PacedSource):
+    """
+    Generates correctly shaped color/depth/IR frames for any ColorResolution and
+    DepthMode at the target rate. A few frames are rendered up front and cycled,
+    so the generator itself costs almost nothing per frame.
+    """
+    serial = "SYNTHETIC"
+
+    def __init__(self, config, fps=None, n_patterns=8):
+        super().__init__(config, fps)
+        ch, cw = color_shape(config)
+        dh, dw = depth_shape(config)
+        self.patterns = []
+        for i in range(n_patterns):
+            shift = i / n_patterns
+            y, x = np.mgrid[0:dh, 0:dw]
+            depth = (500 + 3500 * ((x / dw + shift) % 1.0)).astype(np.uint16) # 0.5 to 4 m ramp
+            ir = ((y / dh + shift) % 1.0 * 1000).astype(np.uint16)
+            color = np.empty((ch, cw, COLOR_CHANNELS), dtype=np.uint8)
+            color[..., 0] = np.uint8(255 * shift)
+            color[..., 1] = np.linspace(0, 255, cw, dtype=np.uint8)[None, :]
+            color[..., 2] = np.linspace(0, 255, ch, dtype=np.uint8)[:, None]
+            color[..., 3] = 255
+            self.patterns.append((color, depth, ir))
+        self.calibration = nominal_calibration(config)
+
+    def _make_capture(self):
+        color, depth, ir = self.patterns[self.frame_index % len(self.patterns)]
+        return SourceCapture(color, depth, ir, self._timestamp())
+
+
+class ReplaySource(PacedSource):
+    """
+    Streams a saved session back in, from the raw files or the rgb/depth/ir image
+    folders (read through a Session, decoding ahead of the frame being played).
+    8-bit depth/IR images are scaled back to millimetres / IR counts with the
+    same factors get_recent_frame used to save them.
+    """
+    serial = "REPLAY"
+
+    def __init__(self, session_dir, config=None, fps=None, loop=True):
+        self.session_dir = session_dir
+        self.loop = loop
+        self.session = Session(session_dir, cache_mb=256, read_ahead=4, n_threads=2)
+        self.raw = self.session.raw
+        self.geometry = 'color'
+        if self.raw:
+            header = self.session.header
+            self.geometry = header.get('geometry', 'color')
+            if config is None and header['config']:
+                config = config_from_dict(header['config'])
+        self.n_frames = len(self.session)
+        if self.n_frames == 0:
+            raise ValueError("No saved frames found in: " + session_dir)
+        if config is None and not self.raw:
+            config = self._guess_config()
+        if config is None:
+            config = pyk4a.Config()
+        super().__init__(config, fps)
+        self.calibration = self.session.calibration
+
+    def _guess_config(self):
+        # image sessions carry no header, find the modes from the image sizes
+        config = pyk4a.Config()
+        shapes = {name: im.shape[:2] for name, im in self.session.frame(0).items()}
+        for res, hw in COLOR_SHAPES.items():
+            if shapes.get('rgb') == hw:
+                config.color_resolution = res
+        depth_hw = shapes.get('depth', shapes.get('ir'))
+        if depth_hw is not None and depth_hw != shapes.get('rgb', depth_hw):
+            self.geometry = 'native'
+            for mode, hw in DEPTH_SHAPES.items():
+                if depth_hw == hw and mode != pyk4a.DepthMode.PASSIVE_IR:
+                    config.depth_mode = mode
+        return config
+
+    def _read(self, frame, name):
+        # frames come from the session cache, they are never changed in place
+        im = frame.get(name)
+        if im is None or self.raw:
+            return im
+        if name != 'rgb' and im.dtype == np.uint8:
+            im = (im.astype(np.uint16) * (20 if name == 'depth' else 10)).astype(np.uint16) # undo alpha 0.05 / 0.10
+        if name == 'rgb' and im.ndim == 3 and im.shape[2] == 3:
+            im = cv2.cvtColor(im, cv2.COLOR_BGR2BGRA)
+        return im
+
+    def _make_capture(self):
+        i = self.frame_index % self.n_frames if self.loop else min(self.frame_index, self.n_frames - 1)
+        frame = self.session.frame(i)
+        color, depth, ir = (self._read(frame, name) for name in ('rgb', 'depth', 'ir'))
+        if color is None:
+            hw = depth.shape if self.geometry == 'color' else color_shape(self._config)
+            color = np.zeros(hw + (COLOR_CHANNELS,), dtype=np.uint8)
+        if ir is None and depth is not None:
+            ir = np.zeros_like(depth)
+        if depth is None:
+            depth = np.zeros(ir.shape if ir is not None else color.shape[:2], dtype=np.uint16)
+            ir = np.zeros_like(depth) if ir is None else ir
+        transformed = {'depth': depth, 'ir': ir} if self.geometry == 'color' else None
+        return SourceCapture(color, depth, ir, self._timestamp(), transformed)
+
+
+def device_sessions(replay_dir):
+    # a session folder, or the per-device session folders of a multi-device recording
+    if any(glob.glob(os.path.join(replay_dir, name + '*')) for name in STREAMS):
+        return [replay_dir]
+    return sorted(os.path.dirname(path) for path in glob.glob(os.path.join(replay_dir, '*', SESSION_FILE)))
+
+def count_devices(kind, replay_dir=None):
+    # devices a source kind can open at once, None if there is no limit
+    if kind == 'k4a':
+        return pyk4a.connected_device_count()
+    if kind == 'replay':
+        return len(device_sessions(replay_dir)) if replay_dir else 0
+    return None
+
+def open_source(kind, config, replay_dir=None, fps=None, device_id=0):
+    # the frame source behind connect_device, device_id picks one of several devices
+    if kind == 'k4a':
+        return PyK4A(config=config, device_id=device_id)
+    if kind == 'synthetic':
+        source = SyntheticSource(config, fps)
+        if device_id:
+            source.serial = "SYNTHETIC" + str(device_id)
+        return source
+    if kind == 'replay':
+        if not replay_dir:
+            raise ValueError("The replay source needs --replay_dir")
+        sessions = device_sessions(replay_dir)
+        if device_id >= len(sessions):
+            raise ValueError("No session for device " + str(device_id) + " in: " + replay_dir)
+        source = ReplaySource(sessions[device_id], fps=fps)
+        if sessions[0] != replay_dir:
+            source.serial = "REPLAY_" + os.path.basename(sessions[device_id])
+        return source
+    raise ValueError("Unknown frame source: " + str(kind))
@@ -0,0 +1,129 @@
+# Description: Per-frame latency trace (acquire, transform, enqueue, dequeue, encode, write), live histograms and a per-session trace file
+
+import os
+import threading
+import time
+import numpy as np
+
+from raw_session import RawStreamWriter, open_stream, RAW_FMT
+
+
+TRACE_FILE = 'trace' + RAW_FMT
+
+# one row per saved frame, times are time.perf_counter_ns() (system wide, comparable between processes)
+TRACE_DTYPE = np.dtype([
+    ('seq', '<i8'),             # frame buffer sequence number
+    ('device_ts_usec', '<i8'),  # device timestamp of the color image
+    ('grab_ns', '<i8'),         # get_capture called
+    ('capture_ns', '<i8'),      # get_capture returned
+    ('transform_ns', '<i8'),    # slot filled (transforms and scaling done)
+    ('enqueue_ns', '<i8'),      # slot committed to the frame buffer
+    ('dequeue_ns', '<i8'),      # slot taken by the saving thread
+    ('encode_ns', '<i8'),       # images encoded
+    ('write_ns', '<i8'),        # files written (and fsynced with --fsync)
+])
+
+# (stage, from field, to field)
+STAGES = (
+    ('acquire', 'grab_ns', 'capture_ns'),
+    ('transform', 'capture_ns', 'transform_ns'),
+    ('enqueue', 'transform_ns', 'enqueue_ns'),
+    ('queue', 'enqueue_ns', 'dequeue_ns'),
+    ('encode', 'dequeue_ns', 'encode_ns'), # includes waiting for a free encoder process
+    ('write', 'encode_ns', 'write_ns'),
+    ('total', 'capture_ns', 'write_ns'),
+)
+
+# histogram bins in milliseconds, log spaced from 10 us to 100 s
+BIN_EDGES_MS = np.concatenate(([0], np.logspace(-2, 5, 141)))
+
+def now_ns():
+    return time.perf_counter_ns()
+
+
+class TraceRecorder:
+    """
+    Collects the trace rows of saved frames. Rows are kept in a preallocated
+    batch and appended to <session>/trace.raw (readable with load_trace) and to
+    the per-stage histograms once the batch is full or flush() is called.
+    record() may be called from any thread.
+    """
+    def __init__(self, session_dir=None, batch_size=256):
+        self.path = os.path.join(session_dir, TRACE_FILE) if session_dir else None
+        self.writer = RawStreamWriter(self.path, (), TRACE_DTYPE) if self.path else None
+        self.batch = np.zeros(batch_size, dtype=TRACE_DTYPE)
+        self.n_batch = 0
+        self.count = 0
+        self.histograms = {stage: np.zeros(len(BIN_EDGES_MS) - 1, dtype=np.int64) for stage, a, b in STAGES}
+        self.max_ms = {stage: 0.0 for stage, a, b in STAGES}
+        self.lock = threading.Lock()
+
+    def record(self, trace, device_ts_usec=0):
+        with self.lock:
+            self.batch[self.n_batch] = trace
+            self.batch['device_ts_usec'][self.n_batch] = device_ts_usec
+            self.n_batch += 1
+            self.count += 1
+            if self.n_batch == len(self.batch):
+                self._flush()
+
+    def _flush(self):
+        rows = self.batch[:self.n_batch]
+        if self.n_batch:
+            if self.writer is not None:
+                self.writer.write(rows)
+            for stage, a, b in STAGES:
+                ms = (rows[b] - rows[a]) / 1e6
+                ms = ms[(rows[a] > 0) & (rows[b] > 0)]
+                if len(ms):
+                    self.histograms[stage] += np.histogram(np.clip(ms, 0, BIN_EDGES_MS[-1]), BIN_EDGES_MS)[0]
+                    self.max_ms[stage] = max(self.max_ms[stage], float(ms.max()))
+        self.n_batch = 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+            if self.writer is not None:
+                self.writer.flush()
+        return self
+
+    def percentile(self, stage, q):
+        # q-th percentile of a stage in ms, from the histogram (upper bin edge, at most the max)
+        counts = self.histograms[stage]
+        total = counts.sum()
+        if total == 0:
+            return 0.0
+        i = np.searchsorted(np.cumsum(counts), q / 100 * total)
+        return min(float(BIN_EDGES_MS[min(i + 1, len(BIN_EDGES_MS) - 1)]), self.max_ms[stage])
+
+    def summary(self):
+        # {stage: (p50 ms, p99 ms, max ms)}
+        self.flush()
+        return {stage: (self.percentile(stage, 50), self.percentile(stage, 99), self.max_ms[stage])
+                for stage, a, b in STAGES}
+
+    def slowest_stage(self):
+        # the stage with the largest p99, 'total' excluded
+        summary = self.summary()
+        stages = [stage for stage, a, b in STAGES if stage != 'total']
+        stage = max(stages, key=lambda s: summary[s][1])
+        return stage, summary[stage][1]
+
+    def summary_text(self):
+        lines = []
+        for stage, (p50, p99, worst) in self.summary().items():
+            lines.append("{:<10} p50 {:9.2f} ms  p99 {:9.2f} ms  max {:9.2f} ms".format(stage, p50, p99, worst))
+        return "\n".join(lines)
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+        return self
+
+
+def load_trace(path):
+    # structured array with one TRACE_DTYPE row per saved frame
+    if os.path.isdir(path):
+        path = os.path.join(path, TRACE_FILE)
+    return np.asarray(open_stream(path))
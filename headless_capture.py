@@ -0,0 +1,189 @@
+# Description: Headless capture, records a session without the GUI (PyQt5 is never imported)
+# usage: python headless_capture.py --fmt .raw --duration 60
+#    or: python myK4a_main.py --headless --n_frames 900
+#    or: python headless_capture.py --burst_seconds 10   (full camera rate into memory, saved afterwards)
+
+import os
+import sys
+import math
+import time
+import threading
+import numpy as np
+
+from capture_args import parser, parse_streams, make_config
+from frame_buffer import FrameBuffer, slot_layout, color_shape, depth_shape, available_memory, shared_memory_free
+from tqdm import tqdm
+from encoder_pool import EncoderPool
+from capture_pipeline import CaptureSession, SESSION_FILE
+from raw_session import RAW_FMT
+from frame_sources import open_source, camera_rate
+from frame_scheduler import FrameScheduler
+
+
+def print_summary(session, stop_reason, burst=None):
+    # burst: (acquisition seconds, flush seconds) of a burst capture, reported apart since nothing is saved while acquiring
+    summary = session.summary()
+    print("Capture stopped: " + stop_reason)
+    print("Frames captured: {}, saved: {}".format(summary.captured, summary.saved))
+    if summary.write_errors:
+        print("WARNING: {} frames could not be written, last error: {}".format(summary.write_errors, session.last_error))
+    print("Frames dropped ({}): {} oldest, {} newest".format(session.backpressure, summary.dropped_oldest, summary.dropped_newest))
+    print("Elapsed: {:.2f} s".format(summary.elapsed))
+    if burst is None:
+        print("Capture rate: {:.2f} fps, save rate: {:.2f} fps".format(summary.capture_fps, summary.save_fps))
+        print("Frame data written: {:.1f} MB/s (uncompressed)".format(summary.mb_per_s))
+    else:
+        acquire_s, flush_s = (max(seconds, 1e-9) for seconds in burst)
+        print("Acquisition: {:.2f} s, {:.2f} fps".format(acquire_s, summary.captured / acquire_s))
+        print("Flush: {:.2f} s, {:.2f} frames/s, {:.1f} MB/s (uncompressed)".format(
+            flush_s, summary.saved / flush_s, summary.saved * session.frame_mb / flush_s))
+    if session.spill is not None:
+        print("Frames spilled to disk: {} (peak {} of {})".format(session.spill.total, session.spill.peak, session.spill.capacity))
+    if session.scheduler is not None:
+        print("Frame rate: " + session.scheduler.summary_text())
+    if session.trace is not None:
+        print("Stage latency:")
+        print(session.trace.summary_text())
+        print("Trace written to: " + session.trace.path)
+    print("Frame manifest written to: " + session.manifest.path)
+    print("Session counters written to: " + os.path.join(session.saving_dir, SESSION_FILE))
+
+def run_headless(args):
+    if args.burst_frames or args.burst_seconds:
+        return run_burst(args)
+    saving_dir = os.path.join(args.working_dir, args.folder_name)
+
+    device = open_source(args.source, make_config(args), args.replay_dir, args.source_fps)
+    device.start()
+    config = device._config # a replay follows the config of the saved session
+    print("Connected to device: " + device.serial)
+
+    depth_dtype = np.uint16 if args.fmt == RAW_FMT else np.uint8
+    frame_buffer = FrameBuffer(config, args.max_qsize, depth_dtype=depth_dtype, shared=args.n_encoders > 0,
+                               streams=parse_streams(args.streams), geometry=args.geometry)
+    encoder_pool = EncoderPool(args.n_encoders)
+    scheduler = FrameScheduler(camera_rate(config), period_ms=args.delay, every_n=args.keep_every)
+    session = CaptureSession(device, frame_buffer, encoder_pool, saving_dir, args.fmt, config,
+                             trace=args.trace, fsync=args.fsync, scheduler=scheduler,
+                             backpressure=args.backpressure, high_water=args.high_water,
+                             spill_gb=args.spill_gb, spill_at=args.spill_at, spill_dir=args.spill_dir).open()
+    print("Saving to: " + saving_dir)
+
+    stop = threading.Event()
+
+    def capture_loop():
+        while not stop.is_set():
+            if session.grab() is None:
+                continue
+            if args.n_frames and session.captured >= args.n_frames:
+                stop.set()
+
+    capture_thread = threading.Thread(target=capture_loop, daemon=True)
+    capture_thread.start()
+
+    # save on the main thread until a limit is reached
+    stop_reason = "frame limit reached"
+    try:
+        while not stop.is_set():
+            if args.duration and time.perf_counter() - session.start_time >= args.duration:
+                stop_reason = "duration reached"
+                break
+            if session.backpressure == 'stop' and session.buffer_full():
+                stop_reason = "buffer full"
+                break
+            session.save_next(timeout=0.1)
+    except KeyboardInterrupt:
+        stop_reason = "interrupted"
+    stop.set()
+    session.request_stop()
+    capture_thread.join()
+
+    # frames already captured are still saved
+    session.drain().close()
+    encoder_pool.shutdown()
+    frame_buffer.close()
+    device.stop()
+
+    print_summary(session, stop_reason)
+    return 1 if session.write_errors else 0
+
+def burst_length(stride, fps, n_frames=0, seconds=0, memory_fraction=0.8, shared=False):
+    # (frames a burst records, frames that fit in memory): the requested count and/or duration,
+    # cut to what fits in memory_fraction of the free memory, and of the free shared memory for a shared buffer
+    requested = [n for n in (n_frames, int(math.ceil(seconds * fps))) if n > 0]
+    free = available_memory()
+    if shared:
+        shm_free = shared_memory_free()
+        if shm_free is not None:
+            free = shm_free if free is None else min(free, shm_free)
+    fits = int(free * memory_fraction) // stride if free is not None else None
+    if fits is not None:
+        requested.append(fits)
+    if not requested:
+        raise ValueError("A burst needs --burst_frames or --burst_seconds when the free memory is unknown")
+    return max(1, min(requested)), fits
+
+def run_burst(args):
+    # every camera frame goes into one preallocated buffer, nothing is encoded or written until the burst is over
+    saving_dir = os.path.join(args.working_dir, args.folder_name)
+
+    device = open_source(args.source, make_config(args), args.replay_dir, args.source_fps)
+    device.start()
+    config = device._config
+    print("Connected to device: " + device.serial)
+
+    depth_dtype = np.uint16 if args.fmt == RAW_FMT else np.uint8
+    streams = parse_streams(args.streams)
+    depth_hw = color_shape(config) if args.geometry == 'color' else depth_shape(config)
+    stride = slot_layout(color_shape(config), depth_hw, depth_dtype, streams)[1]
+    fps = camera_rate(config)
+    shared = args.n_encoders > 0 # the encoder processes read the frames from shared memory
+    n_frames, fits = burst_length(stride, fps, args.burst_frames, args.burst_seconds, args.burst_memory, shared)
+    requested = max(args.burst_frames, int(math.ceil(args.burst_seconds * fps)))
+    if fits is not None and n_frames < requested:
+        print("Burst cut to {} frames ({:.1f} s), the most that fit in {:.0%} of the free {}".format(
+            n_frames, n_frames / fps, args.burst_memory, "memory and /dev/shm" if shared else "memory"))
+
+    frame_buffer = FrameBuffer(config, n_frames, depth_dtype=depth_dtype, shared=shared,
+                               streams=streams, geometry=args.geometry).prefault()
+    print("Burst buffer: {} frames, {:.2f} GB".format(n_frames, frame_buffer.nbytes / 2**30))
+    encoder_pool = EncoderPool(args.n_encoders)
+    scheduler = FrameScheduler(fps) # every camera frame, --delay and --keep_every do not apply
+    session = CaptureSession(device, frame_buffer, encoder_pool, saving_dir, args.fmt, config,
+                             trace=args.trace, fsync=args.fsync, scheduler=scheduler).open()
+
+    stop_reason = "burst complete"
+    try:
+        tic = time.perf_counter()
+        while session.captured < n_frames:
+            if args.burst_seconds and time.perf_counter() - tic >= args.burst_seconds:
+                stop_reason = "burst duration reached"
+                break
+            session.grab()
+    except KeyboardInterrupt:
+        stop_reason = "interrupted"
+    burst_elapsed = time.perf_counter() - tic
+    device.stop()
+    print("Burst: {} frames in {:.2f} s ({:.2f} fps), saving to: {}".format(
+        session.captured, burst_elapsed, session.captured / max(burst_elapsed, 1e-9), saving_dir))
+
+    # flush the buffer through the encoders, the bar counts frames on disk
+    tic = time.perf_counter()
+    with tqdm(total=session.captured, unit='frame') as progress:
+        while session.save_next(timeout=0):
+            progress.update(session.saved - progress.n)
+        while encoder_pool.in_flight():
+            time.sleep(0.05)
+            progress.update(session.saved - progress.n)
+        encoder_pool.join()
+        progress.update(session.saved - progress.n)
+    flush_elapsed = time.perf_counter() - tic
+    session.close()
+    encoder_pool.shutdown()
+    frame_buffer.close()
+
+    print_summary(session, stop_reason, burst=(burst_elapsed, flush_elapsed))
+    return 1 if session.write_errors else 0
+
+if __name__ == "__main__":
+    sys.exit(run_headless(parser.parse_args()))
@@ -1,45 +1,210 @@
+# Description: Make videos from the rgb, depth and ir images of saved sessions
+# usage: python make_vid.py --target_dir test_data
+#        python make_vid.py --working_dir D:/captures --n_jobs 4   (every session in the folder, only what changed)
+#        python make_vid.py --target_dir test_data --composite --tile_scale 0.5   (one RGB|Depth|IR video)
+
 import os
+import sys
 import glob
+import time
+import argparse
+import functools
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import cv2
 import numpy as np
 from tqdm import tqdm
 
-target_dir = 'test_data'
 
-# find images in the color folder
-img_paths_color = glob.glob(os.path.join(target_dir, 'rgb', '**', '*.png'), recursive=True)
-img_paths_color.sort()  
+IMAGE_EXTS = ('.png', '.jpg', '.bmp', '.tiff')
+VIDEOS = (('rgb', 'color.avi'), ('depth', 'depth.avi'), ('ir', 'ir.avi'))
+COMPOSITE = 'composite.avi'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--target_dir', type=str, default='test_data', help='Session folder with the rgb, depth and ir image folders')
+parser.add_argument('--fps', type=float, default=15, help='Frame rate of the videos')
+parser.add_argument('--n_threads', type=int, default=0, help='Threads decoding images ahead of each video writer, 0 to share the cores between the jobs')
+parser.add_argument('--working_dir', type=str, default='', help='Export every session found in this folder instead of --target_dir')
+parser.add_argument('--pattern', type=str, default='*', help='Session folder names to export from --working_dir, e.g. 2024_*_T_*')
+parser.add_argument('--n_jobs', type=int, default=min(4, os.cpu_count() or 1), help='Videos made at the same time, one process each')
+parser.add_argument('--composite', action='store_true', help='Make one video with the rgb, depth and ir frames side by side instead of one per stream')
+parser.add_argument('--tile_scale', type=float, default=1.0, help='Composite: height of every tile as a fraction of the rgb height')
+parser.add_argument('--force', action='store_true', help='Make every video again, even if it is newer than its frames')
+
 
-# find images in the depth folder
-img_paths_depth = glob.glob(os.path.join(target_dir, 'depth', '**', '*.png'), recursive=True)
-img_paths_depth.sort()
+def find_images(folder):
+    # images of a stream folder in frame order
+    paths = glob.glob(os.path.join(folder, '**', '*'), recursive=True)
+    return sorted(path for path in paths if os.path.splitext(path)[1].lower() in IMAGE_EXTS)
 
-# find images in the ir folder
-img_paths_ir = glob.glob(os.path.join(target_dir, 'ir', '**', '*.png'), recursive=True)
-img_paths_ir.sort()
+def read_frames(paths, n_threads=None, ahead=None, read=cv2.imread):
+    # decode images on a thread pool and yield them in order, at most `ahead` decoded frames are held at once
+    # (cv2.imread releases the GIL, so the threads decode in parallel)
+    n_threads = max(1, n_threads or os.cpu_count() or 1)
+    ahead = ahead or 2 * n_threads
+    paths = iter(paths)
+    with ThreadPoolExecutor(n_threads) as pool:
+        pending = deque(pool.submit(read, path) for path in itertools.islice(paths, ahead))
+        while pending:
+            img = pending.popleft().result()
+            for path in itertools.islice(paths, 1):
+                pending.append(pool.submit(read, path))
+            yield img
+
+def read_tiles(frame, tile_scale=1.0):
+    # decode the images of one frame [(stream, path), ...] as tiles of the same height (rgb height * tile_scale),
+    # depth is colorized like the preview
+    tiles = []
+    height = None
+    for stream, path in frame:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE if stream == 'depth' else cv2.IMREAD_COLOR)
+        if height is None:
+            height = max(1, int(round(img.shape[0] * tile_scale)))
+        size = (max(1, int(round(img.shape[1] * height / img.shape[0]))), height)
+        if (img.shape[1], img.shape[0]) != size:
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        if stream == 'depth':
+            img = cv2.applyColorMap(img, cv2.COLORMAP_TURBO)
+        tiles.append(img)
+    return tiles
 
 # define a function to make a video from images in the folder
-def make_video(img_folder, video_name):
-    
-    img_array = []
-    for filename in tqdm(img_folder):
-        img = cv2.imread(filename)
-        height, width, layers = img.shape
-        print(height, width)
-        size = (width,height)
-        img_array.append(img)
-
-    out = cv2.VideoWriter(video_name,cv2.VideoWriter_fourcc(*'DIVX'), 15, size)
-
-    for i in tqdm(range(len(img_array))):
-        out.write(img_array[i])
-    out.release() 
-    
-#create new folder for videos
-if not os.path.exists(os.path.join(target_dir, 'videos')):
-    os.makedirs(os.path.join(target_dir, 'videos'))
-    
-# make videos from images in the folder
-make_video(img_paths_color, os.path.join(target_dir, 'videos', 'color.avi'))
-make_video(img_paths_depth, os.path.join(target_dir, 'videos', 'depth.avi'))
-make_video(img_paths_ir, os.path.join(target_dir, 'videos', 'ir.avi'))
+def make_video(img_paths, video_name, fps=15, n_threads=None, progress=True):
+    # frames are written as they are decoded, memory does not grow with the length of the session
+    out = None
+    count = 0
+    for img in tqdm(read_frames(img_paths, n_threads), total=len(img_paths), disable=not progress):
+        if out is None:
+            height, width = img.shape[:2]
+            out = cv2.VideoWriter(video_name, cv2.VideoWriter_fourcc(*'DIVX'), fps, (width, height))
+        out.write(img)
+        count += 1
+    if out is not None:
+        out.release()
+    return count
+
+def make_composite(frames, video_name, fps=15, n_threads=None, tile_scale=1.0, progress=True):
+    # every image is decoded once (on the pool, already at tile size) and copied into one preallocated canvas
+    out = None
+    canvas = None
+    count = 0
+    read = functools.partial(read_tiles, tile_scale=tile_scale)
+    for tiles in tqdm(read_frames(frames, n_threads, read=read), total=len(frames), disable=not progress):
+        if canvas is None:
+            canvas = np.zeros((tiles[0].shape[0], sum(tile.shape[1] for tile in tiles), 3), dtype=np.uint8)
+            out = cv2.VideoWriter(video_name, cv2.VideoWriter_fourcc(*'DIVX'), fps, (canvas.shape[1], canvas.shape[0]))
+        x = 0
+        for tile in tiles:
+            canvas[:, x:x + tile.shape[1]] = tile
+            x += tile.shape[1]
+        out.write(canvas)
+        count += 1
+    if out is not None:
+        out.release()
+    return count
+
+def is_raw_session(path):
+    # raw sessions keep every stream in one .raw file and have no images to make videos from
+    return any(os.path.exists(os.path.join(path, stream + '.raw')) for stream, video in VIDEOS)
+
+def find_sessions(working_dir, pattern='*'):
+    # folders holding at least one stream folder, the other folders are listed as skipped
+    sessions = []
+    for path in sorted(glob.glob(os.path.join(working_dir, pattern))):
+        if any(os.path.isdir(os.path.join(path, stream)) for stream, video in VIDEOS):
+            sessions.append(path)
+        elif is_raw_session(path):
+            print("Skipped {}: raw session, no image folders".format(path))
+        elif os.path.isdir(path):
+            print("Skipped {}: no rgb, depth or ir folder".format(path))
+    return sessions
+
+def newest_mtime(paths):
+    return max(os.path.getmtime(path) for path in paths)
+
+def up_to_date(video_path, paths):
+    # the folder mtimes in paths also catch deleted frames
+    return os.path.exists(video_path) and os.path.getmtime(video_path) >= newest_mtime(paths)
+
+def find_jobs(session_dir, force=False, composite=False):
+    # (session, stream, video path, images) of the videos that are missing or older than their frames,
+    # a composite job has 'composite' as stream and [(stream, path), ...] per frame as images
+    streams = {}
+    for stream, video in VIDEOS:
+        img_paths = find_images(os.path.join(session_dir, stream))
+        if img_paths:
+            streams[stream] = img_paths
+    folders = [os.path.join(session_dir, stream) for stream in streams]
+
+    if composite:
+        if not streams:
+            return []
+        # frames saved in every stream, matched by name (Img_NNNN)
+        by_name = [{os.path.splitext(os.path.basename(path))[0]: path for path in paths} for paths in streams.values()]
+        names = sorted(set.intersection(*(set(names) for names in by_name)))
+        frames = [tuple(zip(streams, (paths[name] for paths in by_name))) for name in names]
+        video_path = os.path.join(session_dir, 'videos', COMPOSITE)
+        if not force and up_to_date(video_path, [path for paths in streams.values() for path in paths] + folders):
+            return []
+        return [(session_dir, 'composite', video_path, frames)]
+
+    jobs = []
+    for stream, video in VIDEOS:
+        if stream not in streams:
+            continue
+        video_path = os.path.join(session_dir, 'videos', video)
+        if not force and up_to_date(video_path, streams[stream] + [os.path.join(session_dir, stream)]):
+            continue
+        jobs.append((session_dir, stream, video_path, streams[stream]))
+    return jobs
+
+def export_job(job, fps, n_threads, progress=False, tile_scale=1.0):
+    # make one video, returns (frames, seconds); it is written to a temporary file first so an
+    # interrupted export is never mistaken for an up to date one
+    session_dir, stream, video_path, img_paths = job
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    tmp_path = os.path.splitext(video_path)[0] + '.tmp' + os.path.splitext(video_path)[1]
+    tic = time.perf_counter()
+    if stream == 'composite':
+        frames = make_composite(img_paths, tmp_path, fps, n_threads, tile_scale, progress)
+    else:
+        frames = make_video(img_paths, tmp_path, fps, n_threads, progress)
+    os.replace(tmp_path, video_path)
+    return frames, time.perf_counter() - tic
+
+def main(args):
+    if args.working_dir:
+        sessions = find_sessions(args.working_dir, args.pattern)
+    else:
+        sessions = [args.target_dir]
+        if is_raw_session(args.target_dir) and not any(os.path.isdir(os.path.join(args.target_dir, stream)) for stream, video in VIDEOS):
+            print("Skipped {}: raw session, no image folders".format(args.target_dir))
+    jobs = [job for session_dir in sessions for job in find_jobs(session_dir, args.force, args.composite)]
+    print("{} sessions, {} videos to make".format(len(sessions), len(jobs)))
+    if not jobs:
+        return 0
+
+    n_jobs = max(1, min(args.n_jobs, len(jobs)))
+    n_threads = args.n_threads or max(1, (os.cpu_count() or 1) // n_jobs)
+    results = []
+    tic = time.perf_counter()
+    if n_jobs == 1:
+        for job in jobs:
+            results.append((job, export_job(job, args.fps, n_threads, True, args.tile_scale)))
+    else:
+        with ProcessPoolExecutor(n_jobs) as pool:
+            futures = {pool.submit(export_job, job, args.fps, n_threads, False, args.tile_scale): job for job in jobs}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                results.append((futures[future], future.result()))
+    elapsed = time.perf_counter() - tic
+
+    total = 0
+    for (session_dir, stream, video_path, img_paths), (frames, seconds) in sorted(results, key=lambda r: r[0][2]):
+        print("{:<60} {:6d} frames {:8.1f} s {:8.1f} frames/s".format(video_path, frames, seconds, frames / max(seconds, 1e-9)))
+        total += frames
+    print("{} videos, {} frames in {:.1f} s ({:.1f} frames/s)".format(len(results), total, elapsed, total / max(elapsed, 1e-9)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
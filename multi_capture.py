@@ -0,0 +1,240 @@
+# Description: Synchronized capture from several devices (wired master/subordinate sync), one acquisition thread per device
+# usage: python myK4a_main.py --headless --n_devices 0 --fmt .raw   (every connected device)
+#        python multi_capture.py --source synthetic --n_devices 3 --n_frames 300
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import threading
+import numpy as np
+import pyk4a
+
+from capture_args import parser, parse_streams, make_config
+from frame_buffer import FrameBuffer
+from encoder_pool import EncoderPool
+from capture_pipeline import CaptureSession
+from raw_session import RAW_FMT, config_dict
+from frame_sources import open_source, count_devices, camera_rate
+from frame_scheduler import FrameScheduler, SyncGrid
+from frame_manifest import load_manifest
+from headless_capture import print_summary
+
+
+SYNC_FILE = 'sync.json'
+
+
+def device_config(config, mode, delay_usec=0):
+    # a copy of config with the wired sync settings of one device
+    config = copy.copy(config)
+    config.wired_sync_mode = mode
+    config.subordinate_delay_off_master_usec = delay_usec if mode == pyk4a.WiredSyncMode.SUBORDINATE else 0
+    return config
+
+def sync_master(devices, serial=''):
+    # index of the master: the given serial, else the device with only its sync out jack connected, else the first
+    serials = [device.serial for device in devices]
+    if serial:
+        if serial not in serials:
+            raise ValueError("No device with serial " + serial + " among: " + ", ".join(serials))
+        return serials.index(serial)
+    for i, device in enumerate(devices):
+        jacks = getattr(device, 'sync_jack_status', None)
+        if jacks is not None and jacks[1] and not jacks[0]: # (sync in, sync out)
+            return i
+    return 0
+
+def open_devices(args):
+    # open every device and give it its sync config, the master comes first in the returned list
+    n_devices = args.n_devices or count_devices(args.source, args.replay_dir)
+    if not n_devices:
+        raise ValueError("No devices found for source: " + args.source)
+    base = make_config(args)
+    devices = []
+    for i in range(n_devices):
+        device = open_source(args.source, base, args.replay_dir, args.source_fps, device_id=i)
+        if hasattr(device, 'open') and not device.opened:
+            device.open() # the serial of a k4a device is known once it is open
+        devices.append(device)
+    master = sync_master(devices, args.master)
+    devices.insert(0, devices.pop(master))
+
+    if len(devices) > 1:
+        for i, device in enumerate(devices):
+            mode = pyk4a.WiredSyncMode.MASTER if i == 0 else pyk4a.WiredSyncMode.SUBORDINATE
+            device._config = device_config(device._config, mode, i * args.sync_delay_usec)
+    return devices
+
+
+class DeviceCapture:
+    # the frame buffer, scheduler and session of one device, and the loops its acquisition and saving threads run;
+    # the schedulers of all devices keep frames on one SyncGrid, so they pick the same frames
+    def __init__(self, device, saving_dir, encoder_pool, args, grid=None):
+        self.device = device
+        self.serial = device.serial
+        self.config = device._config
+        depth_dtype = np.uint16 if args.fmt == RAW_FMT else np.uint8
+        self.frame_buffer = FrameBuffer(self.config, args.max_qsize, depth_dtype=depth_dtype, shared=args.n_encoders > 0,
+                                        streams=parse_streams(args.streams), geometry=args.geometry)
+        self.scheduler = FrameScheduler(camera_rate(self.config), period_ms=args.delay, every_n=args.keep_every,
+                                        grid=grid, offset_usec=self.config.subordinate_delay_off_master_usec)
+        self.session = CaptureSession(device, self.frame_buffer, encoder_pool, os.path.join(saving_dir, self.serial),
+                                      args.fmt, self.config, trace=args.trace, fsync=args.fsync, scheduler=self.scheduler,
+                                      backpressure=args.backpressure, high_water=args.high_water,
+                                      spill_gb=args.spill_gb, spill_at=args.spill_at, spill_dir=args.spill_dir)
+        self.n_frames = args.n_frames
+        self.done = threading.Event()
+
+    def capture_loop(self, stop):
+        while not stop.is_set() and not self.done.is_set():
+            if self.session.grab() is None:
+                continue
+            if self.n_frames and self.session.captured >= self.n_frames:
+                self.done.set()
+
+    def saving_loop(self, stop):
+        # the encoder pool is shared by every device, the raw format is written on this thread
+        while not stop.is_set():
+            self.session.save_next(timeout=0.1)
+
+
+class MultiDeviceCapture:
+    """
+    Records several devices into <saving_dir>/<serial>/, each one a regular
+    session with its own frame buffer, acquisition thread and saving thread.
+    Image formats are encoded by one encoder pool shared by all devices.
+    Subordinates are started before the master, so none of them misses the
+    master's first sync pulse. The schedulers share the kept frame times, so
+    devices whose first frames arrive out of phase keep the same frames.
+    After close(), pair() matches the saved frames of the devices by device
+    timestamp into <saving_dir>/sync.json.
+    """
+    def __init__(self, devices, saving_dir, args):
+        self.saving_dir = saving_dir
+        self.encoder_pool = EncoderPool(args.n_encoders)
+        self.grid = SyncGrid()
+        self.captures = [DeviceCapture(device, saving_dir, self.encoder_pool, args, self.grid) for device in devices]
+        self.stop = threading.Event()
+        self.threads = []
+        self.start_time = None
+
+    def open(self):
+        if os.path.exists(self.saving_dir):
+            shutil.rmtree(self.saving_dir)
+        os.makedirs(self.saving_dir)
+        for capture in reversed(self.captures): # subordinates first, the master last
+            capture.device.start()
+            capture.session.open()
+        self.start_time = time.perf_counter()
+        for capture in self.captures:
+            for loop in (capture.capture_loop, capture.saving_loop):
+                thread = threading.Thread(target=loop, args=(self.stop,), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        return self
+
+    def done(self):
+        return all(capture.done.is_set() for capture in self.captures)
+
+    def buffer_full(self):
+        return any(c.session.backpressure == 'stop' and c.session.buffer_full() for c in self.captures)
+
+    def close(self):
+        # stop every thread, save what was captured and close the sessions
+        self.stop.set()
+        for capture in self.captures:
+            capture.session.request_stop()
+        for thread in self.threads:
+            thread.join()
+        for capture in self.captures:
+            capture.session.drain()
+        for capture in self.captures:
+            capture.session.close()
+            capture.frame_buffer.close()
+            capture.device.stop()
+        self.encoder_pool.shutdown()
+        return self
+
+    def pair(self, tolerance_usec=None):
+        # match the frames of every subordinate to the master frames by device timestamp, -1 where a device has none
+        master = self.captures[0]
+        if tolerance_usec is None:
+            tolerance_usec = 0.5e6 / camera_rate(master.config)
+        timestamps = []
+        for capture in self.captures:
+            rows = load_manifest(capture.session.saving_dir)
+            delay = capture.config.subordinate_delay_off_master_usec if len(self.captures) > 1 else 0
+            timestamps.append((rows['index'], rows['device_ts_usec'] - delay))
+        pairs = pair_timestamps(timestamps, tolerance_usec)
+        complete = int(np.all(pairs >= 0, axis=1).sum())
+        with open(os.path.join(self.saving_dir, SYNC_FILE), 'w') as f:
+            json.dump({
+                'devices': [{'serial': c.serial, 'config': config_dict(c.config)} for c in self.captures],
+                'tolerance_usec': tolerance_usec,
+                'complete': complete,
+                'pairs': pairs.tolist(), # frame index per device, master first
+            }, f)
+        return pairs, complete
+
+
+def pair_timestamps(timestamps, tolerance_usec):
+    # [(frame indices, timestamps), ...] of each device, master first -> (n master frames, n devices) frame indices;
+    # a frame is paired with the nearest one of every other device, if it is within tolerance_usec
+    master_index, master_ts = timestamps[0]
+    pairs = np.full((len(master_ts), len(timestamps)), -1, dtype=np.int64)
+    pairs[:, 0] = master_index
+    for d, (index, ts) in enumerate(timestamps[1:], start=1):
+        if len(ts) == 0:
+            continue
+        order = np.argsort(ts, kind='stable')
+        ts, index = ts[order], index[order]
+        right = np.clip(np.searchsorted(ts, master_ts), 1, len(ts) - 1) if len(ts) > 1 else np.zeros(len(master_ts), dtype=np.int64)
+        left = np.maximum(right - 1, 0)
+        nearest = np.where(np.abs(ts[left] - master_ts) <= np.abs(ts[right] - master_ts), left, right)
+        matched = np.abs(ts[nearest] - master_ts) <= tolerance_usec
+        pairs[matched, d] = index[nearest[matched]]
+    return pairs
+
+def load_pairs(saving_dir):
+    # (serials, (n, n devices) frame indices) of a multi-device recording
+    with open(os.path.join(saving_dir, SYNC_FILE)) as f:
+        sync = json.load(f)
+    return [device['serial'] for device in sync['devices']], np.array(sync['pairs'], dtype=np.int64).reshape(-1, len(sync['devices']))
+
+def run_multi(args):
+    saving_dir = os.path.join(args.working_dir, args.folder_name)
+    devices = open_devices(args)
+    print("Connected to devices: " + ", ".join(device.serial for device in devices) + " (master " + devices[0].serial + ")")
+    capture = MultiDeviceCapture(devices, saving_dir, args).open()
+    print("Saving to: " + saving_dir)
+
+    stop_reason = "frame limit reached"
+    try:
+        while not capture.done():
+            if args.duration and time.perf_counter() - capture.start_time >= args.duration:
+                stop_reason = "duration reached"
+                break
+            if capture.buffer_full():
+                stop_reason = "buffer full"
+                break
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        stop_reason = "interrupted"
+    capture.close()
+
+    total = 0
+    for device in capture.captures:
+        print("---- " + device.serial)
+        print_summary(device.session, stop_reason)
+        total += device.session.saved
+    elapsed = max(device.session.summary().elapsed for device in capture.captures)
+    pairs, complete = capture.pair()
+    print("All devices: {} frames saved, {:.2f} fps".format(total, total / elapsed))
+    print("Frames paired across all {} devices: {} of {} (written to {})".format(
+        len(capture.captures), complete, len(pairs), os.path.join(saving_dir, SYNC_FILE)))
+    return 1 if any(device.session.write_errors for device in capture.captures) else 0
+
+if __name__ == "__main__":
+    sys.exit(run_multi(parser.parse_args()))
@@ -1,7 +1,29 @@
 import sys
-from PyQt5 import QtWidgets, uic, QtGui
+from capture_args import parser, parse_streams, parse_range
+
+args = parser.parse_args()
+
+if __name__ == "__main__" and args.headless:
+    # record without the GUI, PyQt5 is never imported
+    if args.n_devices != 1:
+        from multi_capture import run_multi
+        sys.exit(run_multi(args))
+    from headless_capture import run_headless
+    sys.exit(run_headless(args))
+
+from PyQt5 import QtWidgets, uic, QtGui, QtCore
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
 from app_functions import *
+from frame_buffer import FrameBuffer
+from encoder_pool import EncoderPool
+from capture_pipeline import CaptureSession
+from raw_session import RAW_FMT
+from frame_sources import open_source, camera_rate
+from frame_scheduler import FrameScheduler
+from frame_mailbox import FrameMailbox
+from capture_metrics import CaptureMetrics, status_text
+from colorize import COLORIZER
+from device_calibration import calibration_dict, CalibrationTables
 import os
 import time
 import numpy as np
@@ -9,28 +31,10 @@ import pyk4a
 from pyk4a import Config, PyK4A
 import gc
 import datetime
-import argparse
 import queue
-import shutil
 
 gc.enable()
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--working_dir', type=str, default=os.getcwd(), help='Directory to save data to')
-parser.add_argument('--folder_name', type=str, default='test_data', help='Name to save data as')
-parser.add_argument('--view', type=str, default='Color', help='Default view to show')
-parser.add_argument('--ui_file', type=str, default='myK4a_app.ui', help='Name of the UI file to use')
-parser.add_argument('--delay', type=int, default=100, help='Delay in milliseconds between frames during data collection')
-parser.add_argument('--fmt', type=str, default='.png', help='File format to save images as')
-parser.add_argument('--selected_res', type=int, default=pyk4a.ColorResolution.RES_720P, help='Image Resolution from camera')
-parser.add_argument('--selected_fps', type=int, default=pyk4a.FPS.FPS_30, help='Frame rate from camera')
-parser.add_argument('--selected_color_format', type=int, default=pyk4a.ImageFormat.COLOR_BGRA32, help='Color format from camera')
-parser.add_argument('--selected_depth_mode', type=int, default=pyk4a.DepthMode.NFOV_UNBINNED, help='Depth mode from camera')
-parser.add_argument('--app_title', type=str, default='K4a Capture App', help='Title of the app')
-parser.add_argument('--max_qsize', type=int, default=100, help='Maximum size of the queue for the capture thread')
-
-args = parser.parse_args()
-
 """
 ------------------------------------------------------------------------------------------------------------------------
 Threads
@@ -39,7 +43,7 @@ Threads
 
 # create a thread to get frames from the kinect camera, and update the preview window
 class streamThread(QThread):
-    image_signal = pyqtSignal(np.ndarray)
+    image_signal = pyqtSignal() # a frame is waiting in the preview mailbox
     def __init__(self):
         super().__init__()
         self.stopped = False
@@ -47,15 +51,18 @@ class streamThread(QThread):
         self.window = None
     
     def run(self):
+        mailbox = self.window.Preview_Mailbox
+        metrics = self.window.Metrics
         while not self.stopped:
             self.device = self.window.device
-            im = get_frame(self.device, self.window.view)
-            self.image_signal.emit(im)
-            
-            set_status(self.window, "Frames Elapsed: " + str(self.window.counter) + " in the streaming thread")
-            
             self.window.counter += 1
-            time.sleep(0.0001)
+            metrics.streamed += 1
+            if not mailbox.due():
+                self.device.get_capture() # keep pace with the camera, this frame is not shown
+                continue
+            im = get_frame(self.device, self.window.view, self.window.geometry, self.window.preview_size)
+            if mailbox.put(im):
+                self.image_signal.emit()
             
     def stop(self):
         self.stopped = True
@@ -64,7 +71,7 @@ class streamThread(QThread):
    
 # create a thread to get frames from the kinect camera
 class captureThread(QThread):
-    image_signal = pyqtSignal(np.ndarray)
+    image_signal = pyqtSignal() # a frame is waiting in the preview mailbox
     def __init__(self):
         super().__init__()
         self.running = True
@@ -73,21 +80,21 @@ class captureThread(QThread):
         
     def run(self):
         self.device = self.window.device
+        session = self.window.Capture_Session
         # start high resolution timer
         tic = time.perf_counter()
         while self.running:
-            self.window.Dummy = get_recent_frame(self.device, self.window.Dummy)
-            self.window.Image_Queue.put(self.window.Dummy) # put data into queue
-            # set_status(self.window, "Frames Captured: " + str(self.window.counter) + ", in the capture thread")
-            
+            slot = session.grab() # fill a free slot and hand it over to the saving thread
+            if slot is None:
+                continue
             # update the preview window every 200ms
             toc = time.perf_counter()
             if (toc - tic) > 0.2:
-                self.image_signal.emit(cv2.cvtColor(self.window.Dummy['rgb'], cv2.COLOR_BGR2RGB))
+                if self.window.Preview_Mailbox.put(preview_image(slot.rgb, self.window.preview_size)):
+                    self.image_signal.emit()
                 tic = toc
             
             self.window.counter += 1
-            time.sleep(self.window.delay/1000)
             
     
     def stop(self):
@@ -98,53 +105,67 @@ class captureThread(QThread):
 
 # create a thread to save frames from the kinect camera
 class savingThread(QThread):
+    saved_signal = pyqtSignal() # the frames left were saved and the session closed
     def __init__(self):
         super().__init__()
         self.stopped = False
+        self.draining = False
         self.window = None
-        self.counter = 0
         
     def run(self):
-        max_qsize = self.window.Image_Queue.maxsize # get the max size of the queue
-        self.window.progressBar.setRange(0, max_qsize) # set the range of the progress bar
+        session = self.window.Capture_Session
+        metrics = self.window.Metrics # the GUI shows the counters, this thread never touches a widget
         while not self.stopped:
             try:
-                qsize = self.window.Image_Queue.qsize() # check how many elements in queue
-                
-                if qsize == max_qsize:
-                    self.stopped = True
+                if session.backpressure == 'stop' and session.buffer_full() and self.window.capture_thread.running:
                     self.window.capture_thread.stop()
                     # self.window.Capture_PB.text.setText("Start Capture")
-                    set_status(self.window,"Buffer full, capture thread stopped")
-                    self.wait()
-                    
-                    break
-                    
+                    status = "Buffer full, capture thread stopped"
+                    if session.trace is not None:
+                        stage, p99 = session.trace.slowest_stage()
+                        status += " (slowest stage: " + stage + ", p99 " + "{:.1f}".format(p99) + " ms)"
+                    metrics.post(status, sticky=True)
                     
-                # get the first element in queue
-                frame = self.window.Image_Queue.get()
-
-                save_data(data=frame,
-                            dir=self.window.saving_dir,
-                            name='Img_'+'{:04d}'.format(self.counter),
-                            fmt=self.window.fmt)
-                
-                try:
-                    set_status(self.window, "Frames Saved: " + str(self.counter) + ", in the saving thread")
-                except:
-                    pass
-                # update progressBar with qsize
-                self.window.progressBar.setValue(qsize) # update the progress bar
-                self.counter += 1
+                # save the oldest frame in the buffer, frames captured before the buffer filled up are still saved
+                session.save_next(timeout=0.1)
                 
             except:
-                set_status(self.window, "Frame saving error")
+                metrics.errors += 1
+                metrics.post("Frame saving error")
+        
+        if self.draining:
+            # the capture is over, save what is left in the buffer and the spill file before closing the session
+            try:
+                session.drain(lambda left: metrics.post("Saving the frames left: " + str(left), sticky=True))
+            except:
+                metrics.errors += 1
+                metrics.post("Frame saving error")
+            session.close() # let the frames being encoded reach the disk
+            self.saved_signal.emit()
+            
+    def finish(self):
+        # stop saving once the frames left are written, saved_signal is emitted then; does not wait
+        self.draining = True
+        self.stopped = True
+        return self
             
     def stop(self):
         self.stopped = True
         self.wait()
         return self
     
+# create a thread to load or build the calibration tables of the connected device, seconds at the high resolutions
+class calibrationThread(QThread):
+    tables_signal = pyqtSignal(object) # the CalibrationTables, every table loaded
+    def __init__(self):
+        super().__init__()
+        self.tables = None
+        
+    def run(self):
+        tables = self.tables
+        if tables is not None:
+            self.tables_signal.emit(tables.load())
+    
 """
 ------------------------------------------------------------------------------------------------------------------------
 Main window class
@@ -165,6 +186,9 @@ class MyWindow(QtWidgets.QMainWindow):
         self.device = None
         self.ui_file = args.ui_file
         self.device_serial_number = ""
+        self.calibration = None
+        self.Calibration_Tables = None # set once calibration_thread has the tables ready
+        self.calibration_thread = None
         self.view = args.view
         self.folder_name = args.folder_name
         self.delay = args.delay
@@ -178,8 +202,21 @@ class MyWindow(QtWidgets.QMainWindow):
         self.fmt = args.fmt
         self.im_W = 0
         self.im_H = 0
-        self.Dummy = None
-        self.Image_Queue = queue.Queue(maxsize=args.max_qsize)
+        self.preview_size = None # (width, height) of the scroll area, frames are scaled down to it in the threads
+        self.Preview_Mailbox = FrameMailbox(args.preview_fps)
+        self.Metrics = CaptureMetrics()
+        COLORIZER.configure('Depth', args.depth_colormap, *parse_range(args.depth_range), args.depth_gamma)
+        COLORIZER.configure('IR', None, *parse_range(args.ir_range))
+        self.max_qsize = args.max_qsize
+        self.Frame_Buffer = None
+        self.n_encoders = args.n_encoders
+        self.Encoder_Pool = None
+        self.Capture_Session = None
+        self.streams = parse_streams(args.streams)
+        self.geometry = args.geometry
+        self.source = args.source
+        self.replay_dir = args.replay_dir
+        self.source_fps = args.source_fps
         self.capturing = False
         self.saving = False
 
@@ -212,6 +249,7 @@ class MyWindow(QtWidgets.QMainWindow):
         self = init_window(self)
         self.Delay_Edit.setText(str(self.delay))
         set_treeView(self, pwd)
+        self.preview_size = (self.scrollArea.width(), self.scrollArea.height())
 
         # initialize the events
         self.Exit_PB.clicked.connect(self.on_exit)
@@ -235,24 +273,77 @@ class MyWindow(QtWidgets.QMainWindow):
         self.Set_PB.clicked.connect(self.on_set)
         self.Capture_PB.clicked.connect(self.on_capture)
 
+        # status line and progress bar follow the worker threads at a fixed rate
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.timeout.connect(self.on_metrics)
+        self.metrics_timer.start(int(1000 / args.status_hz))
+
     
     def empty_queue(self):
-        while not self.Image_Queue.empty():
-            self.Image_Queue = queue.Queue().queue.clear()
-            self.Image_Queue = queue.Queue(maxsize=args.max_qsize)
+        if self.Frame_Buffer is not None:
+            self.Frame_Buffer.clear()
+        return self
+    
+    def make_frame_buffer(self):
+        # preallocate the frame slots for the active config, reuse them if the config did not change
+        # the raw format keeps depth and IR as uint16, images are scaled to 8-bit
+        depth_dtype = np.uint16 if self.fmt == RAW_FMT else np.uint8
+        if self.Frame_Buffer is None or not self.Frame_Buffer.matches(self.config, depth_dtype, self.streams, self.geometry):
+            if self.Frame_Buffer is not None:
+                if self.Encoder_Pool is not None:
+                    self.Encoder_Pool.join()
+                self.Frame_Buffer.close()
+            self.Frame_Buffer = None
+            gc.collect()
+            # slots live in shared memory when frames are encoded in other processes
+            self.Frame_Buffer = FrameBuffer(self.config, self.max_qsize, depth_dtype=depth_dtype, shared=self.n_encoders > 0,
+                                            streams=self.streams, geometry=self.geometry)
+        return self
+    
+    def make_encoder_pool(self):
+        # worker processes are started once and reused for every capture
+        if self.Encoder_Pool is None:
+            self.Encoder_Pool = EncoderPool(self.n_encoders)
         return self
     
     @pyqtSlot(np.ndarray)
     def update_image(self, im):
         self.im_H, self.im_W, channels = im.shape
         bytesPerLine = channels * self.im_W
-        qImg = QtGui.QImage(im.data, self.im_W, self.im_H, bytesPerLine, QtGui.QImage.Format_RGB888)
+        # copied at once: a colorized preview is a buffer of the COLORIZER ring, which the thread
+        # overwrites a few previews later, however long this frame waits for the GUI
+        qImg = QtGui.QImage(im.data, self.im_W, self.im_H, bytesPerLine, QtGui.QImage.Format_RGB888).copy()
         self.Image_Pane.setPixmap(QtGui.QPixmap.fromImage(qImg))
         self.Image_Pane.setScaledContents(True)
-        self.Image_Pane.resize(self.scrollArea.size())
+        # the image was already scaled to fit the scroll area by the thread, keep its aspect
+        self.Image_Pane.resize(self.im_W, self.im_H)
         self.Image_Pane.update()
         return self
     
+    def show_preview(self):
+        # the newest preview frame, frames that came in while the GUI was busy were replaced by it
+        im = self.Preview_Mailbox.take()
+        if im is not None:
+            self.update_image(im)
+        return self
+    
+    def on_metrics(self):
+        # runs on the GUI thread, status_hz times a second
+        snap = self.Metrics.snapshot()
+        if snap.message is not None:
+            set_status(self, snap.message)
+        elif snap.mode != 'idle':
+            set_status(self, status_text(snap))
+        if snap.mode == 'capture':
+            self.progressBar.setRange(0, snap.queue_max)
+            self.progressBar.setValue(snap.queue)
+        return self
+    
+    def resizeEvent(self, event):
+        # the preview threads read the new size for their next frame
+        super().resizeEvent(event)
+        self.preview_size = (self.scrollArea.width(), self.scrollArea.height())
+    
     # @pyqtSlot(int)
     # def capture_update(self, msg):
         # create a message box posting the message
@@ -266,6 +357,9 @@ class MyWindow(QtWidgets.QMainWindow):
         try:
             self.device.stop()
             self.device = None
+            self.Calibration_Tables = None
+            if self.calibration_thread is not None:
+                self.calibration_thread.tables = None # tables still being built are not used
             set_status(self, "Closing the Device... ")
             self.cam_connected = False
         except:
@@ -276,11 +370,21 @@ class MyWindow(QtWidgets.QMainWindow):
     def connect_device(self):
         # try:
         if self.device is None:
-            self.device = PyK4A(config=self.config)
+            self.device = open_source(self.source, self.config, self.replay_dir, self.source_fps)
             self.device.start()
-            self.device.calibration.get_camera_matrix(pyk4a.calibration.CalibrationType.DEPTH)
+            self.config = self.device._config # a replay follows the config of the saved session
+            self.calibration = calibration_dict(self.device.calibration) # saved with every session
             
             self.device_serial_number = self.device.serial
+            if self.calibration is not None:
+                # ray tables and undistortion maps of this device and mode, built only the first time, off the GUI thread
+                if self.calibration_thread is not None:
+                    self.calibration_thread.wait()
+                self.calibration_thread = calibrationThread()
+                self.calibration_thread.tables = CalibrationTables(args.calibration_dir, self.device_serial_number,
+                                                                   self.config, self.calibration)
+                self.calibration_thread.tables_signal.connect(self.on_calibration_tables)
+                self.calibration_thread.start()
             set_status(self, "Connected to device: " + self.device_serial_number)
             self.cam_connected = True
         else:
@@ -289,6 +393,12 @@ class MyWindow(QtWidgets.QMainWindow):
         #     set_status(self, "No device is Found")
         return self
         
+    def on_calibration_tables(self, tables):
+        # the views that need the calibration tables can use them from now on, unless the device changed meanwhile
+        if self.calibration_thread is not None and self.calibration_thread.tables is tables:
+            self.Calibration_Tables = tables
+            set_status(self, "Calibration tables ready: " + tables.dir)
+        
     def update_config(self, restart=False):
         # stop preview
         if self.preview_on:
@@ -349,9 +459,11 @@ class MyWindow(QtWidgets.QMainWindow):
         if self.device is not None:
             if self.stream_thread is None:
                 self.counter = 0
+                self.Preview_Mailbox.clear() # a frame left from the last thread would never be signalled
                 self.stream_thread = streamThread()
                 self.stream_thread.window = self
-                self.stream_thread.image_signal.connect(self.update_image)
+                self.stream_thread.image_signal.connect(self.show_preview)
+                self.Metrics.reset('preview', mailbox=self.Preview_Mailbox)
                 self.stream_thread.start()
                 self.preview_on = True
                 self.Preview_PB.setText("Stop Preview")
@@ -366,6 +478,7 @@ class MyWindow(QtWidgets.QMainWindow):
         if self.preview_on:
             self.preview_on = False
             self.stream_thread.stop()
+            self.Metrics.reset()
             time.sleep(0.5)
             self.stream_thread = None
             self.Preview_PB.setText("Preview")
@@ -380,11 +493,18 @@ class MyWindow(QtWidgets.QMainWindow):
         self.update()
         time.sleep(0.1)
         
-        # delete data and queue
-        self.Dummy = None
-        self.Image_Queue = None
+        # stop the encoders, delete data and queue
+        if self.Encoder_Pool is not None:
+            self.Encoder_Pool.shutdown()
+            self.Encoder_Pool = None
+        if self.Frame_Buffer is not None:
+            self.Frame_Buffer.close()
+        self.Frame_Buffer = None
         
         # delete the stream thread
+        if self.calibration_thread is not None:
+            self.calibration_thread.wait()
+            self.calibration_thread = None
         self.stream_thread = None
         self.saving_thread = None
         self.capture_thread = None
@@ -664,43 +784,18 @@ class MyWindow(QtWidgets.QMainWindow):
         self.folder_name = self.Save_Folder_Edit.text()
         self.delay = int(self.Delay_Edit.text())
         
-        if self.selected_fps == pyk4a.FPS.FPS_5:
-            min_delay = 220
-        elif self.selected_fps == pyk4a.FPS.FPS_15:
-            min_delay = 75
-        elif self.selected_fps == pyk4a.FPS.FPS_30:
-            min_delay = 40
-        
-        if self.delay < min_delay:
-            # throw a warning, with 2 buttons: "Continue" and "Cancel"
-            msg = QtWidgets.QMessageBox()
-            msg.setWindowTitle("Warning")
-            msg.setText("Delay time is too short, this may cause problems with the camera!\n\n Value will be set to: " + str(min_delay) + " ms")
-            msg.setIcon(QtWidgets.QMessageBox.Warning)
-            msg.setStandardButtons(QtWidgets.QMessageBox.Cancel | QtWidgets.QMessageBox.Ok)
-            # change the text on cancel button to "Overrride"
-            msg.button(QtWidgets.QMessageBox.Cancel).setText('Override')
-            msg.setDefaultButton(QtWidgets.QMessageBox.Ok)
-            
-            x = msg.exec_()
-            
-            if x == QtWidgets.QMessageBox.Ok:
-                self.delay = min_delay
-                self.Delay_Edit.setText(str(self.delay))
-            elif x == QtWidgets.QMessageBox.Cancel:
-                pass
+        # frames are picked by device timestamp, a delay below one camera frame keeps every frame
+        frame_ms = 1000 / camera_rate(self.config)
+        delay_note = ""
+        if self.delay < frame_ms:
+            delay_note = ", delay is shorter than one camera frame (" + "{:.0f}".format(frame_ms) + " ms), every frame will be kept"
         
         self.saving_dir = os.path.join(self.working_dir, self.folder_name)
         
-        # create a dummy
-        img_size = (self.im_H, self.im_W, 3)
-        dummy_C = np.zeros(img_size, dtype=np.uint8)
-        dummy_D = np.zeros((self.im_H, self.im_W), dtype=np.uint16)
-        dummy_IR = np.zeros((self.im_H, self.im_W), dtype=np.uint16)
+        # preallocate the frame buffer
+        self.make_frame_buffer()
         
-        self.Dummy = {'rgb': dummy_C, 'depth': dummy_D, 'ir': dummy_IR}
-        
-        set_status(self, "Variables have been set!")
+        set_status(self, "Variables have been set! Frame buffer: " + str(self.Frame_Buffer.nbytes // 2**20) + " MB" + delay_note)
         
         self.Capture_PB.setEnabled(True)
         
@@ -716,12 +811,7 @@ class MyWindow(QtWidgets.QMainWindow):
         self.Delay_Edit.setText(str(self.delay))
         set_treeView(self, self.working_dir)
         
-        img_size = (self.im_H, self.im_W, 3)
-        dummy_C = np.zeros(img_size, dtype=np.uint8)
-        dummy_D = np.zeros((self.im_H, self.im_W), dtype=np.uint16)
-        dummy_IR = np.zeros((self.im_H, self.im_W), dtype=np.uint16)
-        
-        self.Dummy = {'color': dummy_C, 'depth': dummy_D, 'ir': dummy_IR}
+        self.make_frame_buffer()
         
         set_status(self, "Saving Parameters have been reset!")
         
@@ -742,18 +832,23 @@ class MyWindow(QtWidgets.QMainWindow):
                 self.Preview_PB.setText("Preview")
                 self.Preview_PB.setEnabled(False)
                 
+            # the config or format may have changed since the buffer was made
+            self.make_frame_buffer()
+            self.make_encoder_pool()
+            
             # create folder to save the data
-            if os.path.exists(self.saving_dir):
-                shutil.rmtree(self.saving_dir)
-                
-            os.makedirs(self.saving_dir)
-            os.makedirs(os.path.join(self.saving_dir, 'rgb'))
-            os.makedirs(os.path.join(self.saving_dir, 'depth'))
-            os.makedirs(os.path.join(self.saving_dir, 'ir'))
+            scheduler = FrameScheduler(camera_rate(self.config), period_ms=self.delay, every_n=args.keep_every)
+            self.Capture_Session = CaptureSession(self.device, self.Frame_Buffer, self.Encoder_Pool,
+                                                  self.saving_dir, self.fmt, self.config,
+                                                  trace=args.trace, fsync=args.fsync, scheduler=scheduler,
+                                                  backpressure=args.backpressure, high_water=args.high_water,
+                                                  spill_gb=args.spill_gb, spill_at=args.spill_at, spill_dir=args.spill_dir).open()
                 
             set_status(self, "Saving Directory created: " + self.saving_dir)
             
             
+            self.Metrics.reset('capture', self.Capture_Session, self.Preview_Mailbox)
+            
             # start the saving thread
             self.saving = True
             self.saving_thread = savingThread()
@@ -762,35 +857,55 @@ class MyWindow(QtWidgets.QMainWindow):
             
             # start the capturing thread
             self.capturing = True
+            self.Preview_Mailbox.clear()
             self.capture_thread = captureThread()
             self.capture_thread.window = self
-            self.capture_thread.image_signal.connect(self.update_image)
+            self.capture_thread.image_signal.connect(self.show_preview)
             self.capture_thread.start()
             
             set_status(self, "Capturing data...")
         else:
             self.capturing = False
-            self.saving = False
             
-            self.saving_thread.stop()
+            self.Capture_Session.request_stop() # a blocked capture thread gives up its frame
             self.capture_thread.stop()
             
-            self.empty_queue()
-            
-            self.saving_thread = None
-            self.capture_thread = None
-            
-            # reset the progress bar
-            self.progressBar.setValue(0)
+            # the saving thread writes the frames still in the buffer and the spill file, then closes the session
+            self.Capture_PB.setText("Saving...")
+            self.Capture_PB.setEnabled(False)
+            set_status(self, "Saving the frames left in the buffer...")
+            self.saving_thread.saved_signal.connect(self.on_capture_saved)
+            self.saving_thread.finish()
     
-            self.Capture_PB.setText("Start Capture")
-            self.Preview_PB.setEnabled(True)
-            self.Preview_PB.setText("Preview")
-            set_status(self, "Capture stopped!")
-            time.sleep(2)
-            
-            # restart the preview
-            self.start_preview()
+    def on_capture_saved(self):
+        # the saving thread is done with the session
+        self.saving = False
+        self.saving_thread.wait()
+        self.Metrics.reset()
+        
+        rate_text = self.Capture_Session.scheduler.summary_text()
+        summary = self.Capture_Session.summary()
+        if summary.dropped_oldest or summary.dropped_newest:
+            rate_text += ", dropped {} oldest / {} newest".format(summary.dropped_oldest, summary.dropped_newest)
+        if summary.write_errors:
+            rate_text += ", WARNING: {} frames not written ({})".format(summary.write_errors, self.Capture_Session.last_error)
+        self.Capture_Session = None
+        self.empty_queue()
+        
+        self.saving_thread = None
+        self.capture_thread = None
+        
+        # reset the progress bar
+        self.progressBar.setValue(0)
+
+        self.Capture_PB.setText("Start Capture")
+        self.Capture_PB.setEnabled(True)
+        self.Preview_PB.setEnabled(True)
+        self.Preview_PB.setText("Preview")
+        set_status(self, "Capture stopped! Frame rate " + rate_text)
+        
+        # restart the preview
+        self.start_preview()
     
 def main():
     app = QtWidgets.QApplication(sys.argv)
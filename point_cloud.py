@@ -0,0 +1,127 @@
+# Description: Export the depth frames of a saved session as point clouds (binary PLY or .npy), one file per frame
+# usage: python point_cloud.py --target_dir test_data
+#        python point_cloud.py --target_dir test_data --fmt .npy --n_jobs 8 --no_color
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from tqdm import tqdm
+
+from session_reader import Session
+from device_calibration import CALIBRATION_FILE, CALIBRATION_DIR, CalibrationTables, intrinsics, ray_table
+from raw_session import config_from_dict
+
+
+POINT_FORMATS = ('.ply', '.npy')
+POINTS_DIR = 'points'
+DEPTH_8BIT_MM = 20 # 8-bit depth images were saved with alpha 0.05
+
+# x, y, z in millimetres in the frame of the camera the depth is in, colors as RGB
+XYZ_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+XYZRGB_DTYPE = np.dtype(XYZ_DTYPE.descr + [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--target_dir', type=str, default='test_data', help='Session folder to export')
+parser.add_argument('--fmt', type=str, default='.ply', choices=POINT_FORMATS, help='Point cloud file format')
+parser.add_argument('--no_color', action='store_true', help='XYZ only, even when the depth is in the color geometry')
+parser.add_argument('--n_jobs', type=int, default=os.cpu_count(), help='Processes converting frames')
+parser.add_argument('--calibration_dir', type=str, default=CALIBRATION_DIR, help='Cache of the per-device ray tables, shared with the capture app')
+parser.add_argument('--chunk', type=int, default=16, help='Frames per task sent to a process')
+
+
+def session_rays(session, cache_dir=CALIBRATION_DIR, camera=None):
+    # ray table of the camera the session depth is in (the color camera, or the depth camera for native geometry),
+    # from the calibration cache when the session knows its device
+    calibration = session.calibration
+    if calibration is None:
+        raise ValueError("No " + CALIBRATION_FILE + " in " + session.dir + " (sessions recorded before it was saved have none)")
+    camera = camera or ('depth' if session.geometry == 'native' else 'color')
+    info = session.info
+    if cache_dir and info.get('serial') and info.get('config'):
+        rays = CalibrationTables(cache_dir, info['serial'], config_from_dict(info['config']), calibration).rays(camera)
+        if rays.shape[:2] == session.shape('depth')[:2]:
+            return rays
+    matrix, distortion = intrinsics(calibration, camera)
+    return ray_table(matrix, distortion, session.shape('depth')[:2])
+
+def unproject(depth, rays, color=None):
+    # one structured array of the points with a depth, all pixels in one vectorized pass
+    valid = depth > 0
+    z = depth[valid].astype(np.float32)
+    if depth.dtype == np.uint8:
+        z *= DEPTH_8BIT_MM
+    points = np.empty(len(z), dtype=XYZ_DTYPE if color is None else XYZRGB_DTYPE)
+    ray = rays[valid]
+    np.multiply(ray[:, 0], z, out=points['x'])
+    np.multiply(ray[:, 1], z, out=points['y'])
+    points['z'] = z
+    if color is not None:
+        bgr = color[valid]
+        points['red'], points['green'], points['blue'] = bgr[:, 2], bgr[:, 1], bgr[:, 0]
+    return points
+
+def write_ply(path, points):
+    # binary little endian PLY, the vertex properties are the fields of the structured array
+    types = {'<f4': 'float', '|u1': 'uchar'}
+    header = ["ply", "format binary_little_endian 1.0", "element vertex " + str(len(points))]
+    header += ["property {} {}".format(types[points.dtype.fields[name][0].str], name) for name in points.dtype.names]
+    header.append("end_header\n")
+    with open(path, 'wb') as f:
+        f.write("\n".join(header).encode('ascii'))
+        f.write(memoryview(np.ascontiguousarray(points)).cast('B'))
+
+def write_points(path, points):
+    if path.endswith('.npy'):
+        np.save(path, points)
+    else:
+        write_ply(path, points)
+
+_sessions = {} # per process: session folder -> (open Session, ray table), a session is listed once per process
+
+def export_frames(session_dir, indices, out_dir, fmt, color=True, cache_dir=CALIBRATION_DIR):
+    # convert frames of a session, returns (frames, points); run in the worker processes
+    if session_dir not in _sessions:
+        session = Session(session_dir, cache_mb=0)
+        _sessions[session_dir] = (session, session_rays(session, cache_dir))
+    session, rays = _sessions[session_dir]
+    color = color and session.geometry == 'color' and 'rgb' in session.streams
+    n_points = 0
+    for i in indices:
+        frame = session.frame(i)
+        points = unproject(frame['depth'], rays, frame['rgb'] if color else None)
+        write_points(os.path.join(out_dir, session.name(i) + fmt), points)
+        n_points += len(points)
+    return len(indices), n_points
+
+def main(args):
+    with Session(args.target_dir, cache_mb=0) as session:
+        if 'depth' not in session.streams:
+            print("No depth frames in: " + args.target_dir)
+            return 1
+        session_rays(session, args.calibration_dir) # fail early without a calibration, builds the cached tables once
+        n_frames = len(session)
+    out_dir = os.path.join(args.target_dir, POINTS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    chunks = [range(i, min(i + args.chunk, n_frames)) for i in range(0, n_frames, args.chunk)]
+    print("{} frames to export to: {}".format(n_frames, out_dir))
+
+    total_points = 0
+    tic = time.perf_counter()
+    with ProcessPoolExecutor(max(1, min(args.n_jobs, len(chunks)))) as pool:
+        futures = [pool.submit(export_frames, args.target_dir, chunk, out_dir, args.fmt, not args.no_color, args.calibration_dir)
+                   for chunk in chunks]
+        with tqdm(total=n_frames) as progress:
+            for future in as_completed(futures):
+                frames, points = future.result()
+                total_points += points
+                progress.update(frames)
+    elapsed = max(time.perf_counter() - tic, 1e-9)
+    print("{} frames, {} points in {:.1f} s ({:.1f} frames/s, {:.2f} M points/s)".format(
+        n_frames, total_points, elapsed, n_frames / elapsed, total_points / elapsed / 1e6))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,150 @@
+# Description: Raw, memory-mappable session format (one append-only fixed-stride file per stream)
+
+import os
+import json
+import numpy as np
+import pyk4a
+
+
+RAW_FMT = '.raw'
+RAW_MAGIC = b'K4ARAW01'
+HEADER_BYTES = 4096 # header is padded so frame data starts page aligned
+
+
+def config_dict(config):
+    # pyk4a Config as plain json values, enums are stored by name
+    if config is None:
+        return {}
+    out = {}
+    for key, value in vars(config).items():
+        out[key] = value.name if hasattr(value, 'name') else value
+    return out
+
+def saved_enum(cls, value):
+    # config values are saved by name, or as the int they were given as on the command line
+    return cls[value] if isinstance(value, str) else cls(value)
+
+def config_from_dict(saved):
+    # pyk4a Config back from config_dict
+    return pyk4a.Config(
+        color_resolution=saved_enum(pyk4a.ColorResolution, saved['color_resolution']),
+        depth_mode=saved_enum(pyk4a.DepthMode, saved['depth_mode']),
+        color_format=saved_enum(pyk4a.ImageFormat, saved['color_format']),
+        camera_fps=saved_enum(pyk4a.FPS, saved['camera_fps']))
+
+def dtype_descr(dtype):
+    # json friendly dtype, structured dtypes are kept as their field list
+    dtype = np.dtype(dtype)
+    return dtype.descr if dtype.names else dtype.str
+
+def dtype_from_descr(descr):
+    if isinstance(descr, list):
+        return np.dtype([tuple(field) for field in descr])
+    return np.dtype(descr)
+
+
+class RawStreamWriter:
+    """
+    Appends frames of a fixed shape and dtype to <path>. Writing a frame is a
+    single write of its bytes; the frame count is derived from the file size,
+    so the header never has to be rewritten and a crashed recording is still
+    readable up to its last complete frame.
+    """
+    def __init__(self, path, shape, dtype, config=None, extra=None):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+        self.count = 0
+
+        header = {
+            'stream': os.path.splitext(os.path.basename(path))[0],
+            'shape': list(self.shape),
+            'dtype': dtype_descr(self.dtype),
+            'frame_bytes': self.frame_bytes,
+            'header_bytes': HEADER_BYTES,
+            'config': config_dict(config),
+        }
+        if extra:
+            header.update(extra)
+        text = json.dumps(header).encode('utf-8')
+        if len(RAW_MAGIC) + len(text) > HEADER_BYTES:
+            raise ValueError("Raw header is too large: " + str(len(text)) + " bytes")
+
+        self.file = open(path, 'wb')
+        self.file.write(RAW_MAGIC + text.ljust(HEADER_BYTES - len(RAW_MAGIC), b' '))
+
+    def write(self, array):
+        # one frame, or several stacked along the first axis
+        array = np.ascontiguousarray(array)
+        self.file.write(memoryview(array).cast('B'))
+        self.count += array.nbytes // self.frame_bytes
+        return self
+
+    def flush(self, fsync=False):
+        if self.file.closed:
+            return self
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+        return self
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        return self
+
+
+class RawSessionWriter:
+    # rgb.raw, depth.raw and ir.raw for the slots of a frame buffer
+    def __init__(self, dir, frame_buffer, config=None, extra=None):
+        self.dir = dir
+        self.writers = {}
+        for name, shape, dtype, offset in frame_buffer.layout:
+            self.writers[name] = RawStreamWriter(os.path.join(dir, name + RAW_FMT), shape, dtype, config, extra)
+
+    def write(self, slot):
+        for name, writer in self.writers.items():
+            writer.write(getattr(slot, name))
+        return self
+
+    @property
+    def count(self):
+        return min(writer.count for writer in self.writers.values())
+
+    def flush(self, fsync=False):
+        for writer in self.writers.values():
+            writer.flush(fsync)
+        return self
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        return self
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_BYTES)
+    if not head.startswith(RAW_MAGIC):
+        raise ValueError("Not a raw stream file: " + path)
+    header = json.loads(head[len(RAW_MAGIC):].decode('utf-8'))
+    header['dtype'] = dtype_from_descr(header['dtype'])
+    header['shape'] = tuple(header['shape'])
+    return header
+
+def frame_count(path, header=None):
+    header = read_header(path) if header is None else header
+    return (os.path.getsize(path) - header['header_bytes']) // header['frame_bytes']
+
+def open_stream(path, start=0, stop=None, mode='r'):
+    # memory map frames [start, stop) of a raw stream as a (n, *shape) array, no data is read
+    header = read_header(path)
+    n = frame_count(path, header)
+    stop = n if stop is None else min(stop, n)
+    start = min(max(start, 0), stop)
+    if stop == start:
+        return np.empty((0,) + header['shape'], dtype=header['dtype']) # empty files cannot be mapped
+    return np.memmap(path, dtype=header['dtype'], mode=mode,
+                     offset=header['header_bytes'] + start * header['frame_bytes'],
+                     shape=(stop - start,) + header['shape'])
@@ -0,0 +1,198 @@
+# Description: Offline registration of native depth/IR sessions into the color camera geometry (record with --geometry native)
+# usage: python register_session.py --target_dir test_data
+#        python register_session.py --target_dir test_data --n_jobs 8 --batch 8
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from session_reader import Session
+from raw_session import RawStreamWriter, open_stream, config_from_dict, RAW_FMT
+from frame_buffer import color_shape
+from device_calibration import CALIBRATION_DIR, intrinsics, extrinsics
+from point_cloud import session_rays, DEPTH_8BIT_MM
+
+
+REGISTERED_DIR = 'registered'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--target_dir', type=str, default='test_data', help='Session folder recorded with --geometry native')
+parser.add_argument('--n_jobs', type=int, default=os.cpu_count(), help='Processes registering frames')
+parser.add_argument('--chunk', type=int, default=16, help='Frames per task sent to a process')
+parser.add_argument('--batch', type=int, default=4, help='Frames registered together in one vectorized pass')
+parser.add_argument('--splat', type=int, default=0, help='Color pixels covered by a depth pixel along each axis, 0 from the focal lengths')
+parser.add_argument('--calibration_dir', type=str, default=CALIBRATION_DIR, help='Cache of the per-device ray tables, shared with the capture app')
+
+
+class Registration:
+    """
+    Maps depth camera frames to the color camera with the session calibration,
+    like capture.transformed_depth / transformed_ir.
+
+    Every depth pixel is unprojected with its ray, moved to the color camera,
+    projected through the color lens model and splatted over splat x splat
+    color pixels (the color camera has the higher resolution); where pixels
+    land on the same color pixel the nearest one is kept. A batch of frames
+    is one pass of array operations and one sort.
+    """
+    def __init__(self, calibration, rays, color_hw, splat=0):
+        self.matrix, self.distortion = intrinsics(calibration, 'color')
+        depth_matrix = intrinsics(calibration, 'depth')[0]
+        rotation, translation = extrinsics(calibration) # millimetres, like the depth
+        self.translation = translation.astype(np.float32)
+        self.color_hw = tuple(color_hw)
+        # rotated once, a point in the color camera is then z * ray + translation
+        rays = np.asarray(rays, dtype=np.float32).reshape(-1, 2)
+        self.rays = np.concatenate((rays, np.ones((len(rays), 1), dtype=np.float32)), axis=1) @ rotation.T.astype(np.float32)
+        self.splat = splat or max(1, int(np.ceil(self.matrix[0, 0] / depth_matrix[0, 0])))
+
+    def project(self, flat, z):
+        # color pixel (u, v) of the depth pixels at flat indices with depth z (mm), and whether they are in front of it
+        points = self.rays[flat] * z[:, None]
+        points += self.translation
+        x = points[:, 0] / points[:, 2]
+        y = points[:, 1] / points[:, 2]
+        k1, k2, p1, p2, k3, k4, k5, k6 = np.pad(self.distortion, (0, 8))[:8].astype(np.float32)
+        r2 = x * x + y * y
+        radial = (1 + r2 * (k1 + r2 * (k2 + r2 * k3))) / (1 + r2 * (k4 + r2 * (k5 + r2 * k6)))
+        xy = x * y
+        u = (x * radial + 2 * p1 * xy + p2 * (r2 + 2 * x * x)) * self.matrix[0, 0] + self.matrix[0, 2]
+        v = (y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * xy) * self.matrix[1, 1] + self.matrix[1, 2]
+        return u, v, points[:, 2] > 0
+
+    def register(self, depth, ir=None):
+        # (n, h, w) depth (and IR) of the depth camera -> (n, color h, color w) of the same dtype, 0 where nothing landed
+        n = len(depth)
+        ch, cw = self.color_hw
+        frame, flat = np.nonzero(depth.reshape(n, -1))
+        values = depth.reshape(n, -1)[frame, flat]
+        z = values.astype(np.float32)
+        if depth.dtype == np.uint8:
+            z *= DEPTH_8BIT_MM
+        u, v, valid = self.project(flat, z)
+        shift = (self.splat - 1) / 2
+        u0 = np.floor(u + 0.5 - shift).astype(np.int64)
+        v0 = np.floor(v + 0.5 - shift).astype(np.int64)
+        # points whose splat overlaps the color image, offsets past its edge are clipped onto the edge pixels it covers
+        keep = valid & (u0 > -self.splat) & (u0 < cw) & (v0 > -self.splat) & (v0 < ch)
+        u0, v0, frame, flat, values = u0[keep], v0[keep], frame[keep], flat[keep], values[keep]
+
+        # key = color pixel of the batch, then depth, then IR: once sorted the nearest point of every pixel comes first
+        # (a sort rather than np.minimum.at, which is slow before numpy 1.25)
+        packed = values.astype(np.uint64) << np.uint64(16)
+        if ir is not None:
+            packed |= ir.reshape(n, -1)[frame, flat]
+        frame = frame * (ch * cw)
+        keys = np.empty((self.splat * self.splat, len(packed)), dtype=np.uint64)
+        for dy in range(self.splat):
+            row = frame + np.clip(v0 + dy, 0, ch - 1) * cw
+            for dx in range(self.splat):
+                key = keys[dy * self.splat + dx]
+                np.add(row, np.clip(u0 + dx, 0, cw - 1), out=key, casting='unsafe')
+                key <<= np.uint64(32)
+                key |= packed
+        keys = np.sort(keys.reshape(-1))
+        index = keys >> np.uint64(32)
+        first = np.empty(len(keys), dtype=bool)
+        first[:1] = True
+        np.not_equal(index[1:], index[:-1], out=first[1:])
+        keys, index = keys[first], index[first]
+
+        out_depth = np.zeros((n, ch, cw), dtype=depth.dtype)
+        out_depth.reshape(-1)[index] = (keys >> np.uint64(16)) & np.uint64(0xFFFF)
+        if ir is None:
+            return out_depth, None
+        out_ir = np.zeros((n, ch, cw), dtype=ir.dtype)
+        out_ir.reshape(-1)[index] = keys & np.uint64(0xFFFF)
+        return out_depth, out_ir
+
+def session_color_hw(session):
+    # size of the color camera of a session, from its rgb frames or its config
+    if 'rgb' in session.streams:
+        return session.shape('rgb')[:2]
+    saved = session.header.get('config') or session.info.get('config')
+    if not saved:
+        raise ValueError("Cannot tell the color resolution of: " + session.dir)
+    return color_shape(config_from_dict(saved))
+
+def output_paths(session, out_dir, stream, i):
+    # registered image of frame i, same file format as the input
+    ext = os.path.splitext(session.paths[stream][i])[1]
+    return os.path.join(out_dir, stream, session.name(i) + ext)
+
+_sessions = {} # per process: session folder -> (open Session, Registration), a session is listed once per process
+
+def register_frames(session_dir, indices, out_dir, color_hw, batch=4, splat=0, cache_dir=CALIBRATION_DIR):
+    # register frames of a session into out_dir, returns the number of frames; run in the worker processes
+    if session_dir not in _sessions:
+        session = Session(session_dir, streams=('depth', 'ir'), cache_mb=0)
+        rays = session_rays(session, cache_dir, camera='depth')
+        _sessions[session_dir] = (session, Registration(session.calibration, rays, color_hw, splat))
+    session, registration = _sessions[session_dir]
+    outputs = {name: open_stream(os.path.join(out_dir, name + RAW_FMT), mode='r+') for name in session.streams} if session.raw else None
+    indices = list(indices)
+    for start in range(0, len(indices), batch):
+        batch_indices = indices[start:start + batch]
+        frames = session.frames(batch_indices)
+        depth, ir = registration.register(frames['depth'], frames.get('ir'))
+        for name, registered in (('depth', depth), ('ir', ir)):
+            if registered is None:
+                continue
+            if outputs is not None:
+                outputs[name][batch_indices[0]:batch_indices[-1] + 1] = registered
+            else:
+                for i, im in zip(batch_indices, registered):
+                    cv2.imwrite(output_paths(session, out_dir, name, i), im)
+    if outputs is not None:
+        for output in outputs.values():
+            output.flush()
+    return len(indices)
+
+def create_outputs(session, out_dir, color_hw):
+    # registered/<stream>.raw of the full size (written in place by the workers), or registered/<stream>/ for images
+    os.makedirs(out_dir, exist_ok=True)
+    for name in session.streams:
+        if not session.raw:
+            os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+            continue
+        config = config_from_dict(session.header['config']) if session.header.get('config') else None
+        writer = RawStreamWriter(os.path.join(out_dir, name + RAW_FMT), color_hw, session.maps[name].dtype,
+                                 config, extra={'geometry': 'color'})
+        writer.file.truncate(writer.file.tell() + len(session) * writer.frame_bytes)
+        writer.close()
+
+def main(args):
+    with Session(args.target_dir, cache_mb=0) as session:
+        if session.geometry != 'native':
+            print("Depth is already in the color geometry: " + args.target_dir)
+            return 1
+        color_hw = session_color_hw(session)
+    with Session(args.target_dir, streams=('depth', 'ir'), cache_mb=0) as session:
+        if 'depth' not in session.streams:
+            print("No depth frames in: " + args.target_dir)
+            return 1
+        session_rays(session, args.calibration_dir, camera='depth') # fail early without a calibration, builds the cached tables once
+        n_frames = len(session)
+        out_dir = os.path.join(args.target_dir, REGISTERED_DIR)
+        create_outputs(session, out_dir, color_hw)
+    chunks = [range(i, min(i + args.chunk, n_frames)) for i in range(0, n_frames, args.chunk)]
+    print("{} frames to register into: {}".format(n_frames, out_dir))
+
+    tic = time.perf_counter()
+    with ProcessPoolExecutor(max(1, min(args.n_jobs, len(chunks)))) as pool:
+        futures = [pool.submit(register_frames, args.target_dir, chunk, out_dir, color_hw, args.batch, args.splat, args.calibration_dir)
+                   for chunk in chunks]
+        with tqdm(total=n_frames) as progress:
+            for future in as_completed(futures):
+                progress.update(future.result())
+    elapsed = max(time.perf_counter() - tic, 1e-9)
+    print("{} frames in {:.1f} s ({:.1f} frames/s)".format(n_frames, elapsed, n_frames / elapsed))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
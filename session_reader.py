@@ -0,0 +1,192 @@
+# Description: Random access to a saved session, raw files or image folders, with an LRU cache of decoded frames
+
+import os
+import glob
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from frame_buffer import STREAMS
+from raw_session import RAW_FMT, read_header, open_stream
+from frame_manifest import MANIFEST_FILE, load_manifest
+from capture_pipeline import SESSION_FILE
+from device_calibration import load_calibration
+
+
+class Session:
+    """
+    Indexes a session folder once. frame(i) returns {stream: array} for frame
+    i, session[a:b] and frames(indices) return {stream: stacked array}.
+
+    Raw sessions are memory mapped, image sessions are decoded with
+    cv2.imread(IMREAD_UNCHANGED) (values as saved: BGR color, 8-bit scaled
+    depth/IR). Frames are matched across streams by name (Img_NNNN), only
+    frames saved in every stream are indexed.
+
+    Decoded frames are kept in an LRU of at most cache_mb. With read_ahead > 0
+    the next read_ahead frames after each access are decoded on n_threads
+    background threads, so sequential reads find them ready.
+    """
+    def __init__(self, session_dir, streams=STREAMS, cache_mb=512, read_ahead=0, n_threads=None):
+        self.dir = session_dir
+        self.raw = any(os.path.exists(os.path.join(session_dir, name + RAW_FMT)) for name in STREAMS)
+        self.header = {}
+        if self.raw:
+            self.streams = tuple(name for name in streams if os.path.exists(os.path.join(session_dir, name + RAW_FMT)))
+            self.header = read_header(os.path.join(session_dir, self.streams[0] + RAW_FMT)) if self.streams else {}
+            self.maps = {name: open_stream(os.path.join(session_dir, name + RAW_FMT)) for name in self.streams}
+            self.n_frames = min((len(frames) for frames in self.maps.values()), default=0)
+        else:
+            by_name = {}
+            for name in streams:
+                paths = sorted(glob.glob(os.path.join(session_dir, name, 'Img_*')))
+                if paths:
+                    by_name[name] = {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+            self.streams = tuple(by_name)
+            self.names = sorted(set.intersection(*(set(paths) for paths in by_name.values()))) if by_name else []
+            self.paths = {name: [by_name[name][i] for i in self.names] for name in self.streams}
+            self.n_frames = len(self.names)
+        if not self.streams:
+            raise FileNotFoundError("No saved frames found in: " + session_dir)
+
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.cache_limit = int(cache_mb * 2**20)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.read_ahead = read_ahead
+        self.pending = {}
+        self.pool = ThreadPoolExecutor(n_threads or os.cpu_count()) if read_ahead > 0 else None
+
+    def __len__(self):
+        return self.n_frames
+
+    @property
+    def info(self):
+        # session.json of the capture, {} for sessions saved before it existed
+        path = os.path.join(self.dir, SESSION_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @property
+    def calibration(self):
+        # calibration.json of the capture, None for sessions saved before it existed
+        return load_calibration(self.dir)
+
+    @property
+    def geometry(self):
+        # 'color' if depth/IR were transformed to the color camera, 'native' if saved as the depth camera sees them
+        if self.raw:
+            return self.header.get('geometry', 'color')
+        if 'geometry' in self.info:
+            return self.info['geometry']
+        shapes = [self.shape(name)[:2] for name in self.streams]
+        return 'color' if all(hw == shapes[0] for hw in shapes) else 'native'
+
+    def shape(self, stream):
+        # shape of one frame of a stream
+        if self.raw:
+            return self.maps[stream].shape[1:]
+        return self.frame(0)[stream].shape
+
+    def name(self, i):
+        # file name of frame i without the extension (Img_NNNN)
+        return self.names[i] if not self.raw else 'Img_{:04d}'.format(i)
+
+    def manifest(self, pandas=False):
+        # per-frame manifest rows, None for sessions saved before it existed
+        if not os.path.exists(os.path.join(self.dir, MANIFEST_FILE)):
+            return None
+        return load_manifest(self.dir, pandas)
+
+    def _decode(self, i):
+        if self.raw:
+            return {name: np.array(frames[i]) for name, frames in self.maps.items()}
+        return {name: cv2.imread(self.paths[name][i], cv2.IMREAD_UNCHANGED) for name in self.streams}
+
+    def _cached(self, i):
+        with self.lock:
+            frame = self.cache.get(i)
+            if frame is not None:
+                self.cache.move_to_end(i)
+            return frame
+
+    def _store(self, i, frame):
+        nbytes = sum(im.nbytes for im in frame.values())
+        with self.lock:
+            self.pending.pop(i, None)
+            if i in self.cache or nbytes > self.cache_limit:
+                return
+            self.cache[i] = frame
+            self.cache_bytes += nbytes
+            while self.cache_bytes > self.cache_limit:
+                old_i, old = self.cache.popitem(last=False) # least recently used
+                self.cache_bytes -= sum(im.nbytes for im in old.values())
+
+    def _load(self, i):
+        # decode frame i and cache it (run by the read-ahead threads)
+        frame = self._decode(i)
+        self._store(i, frame)
+        return frame
+
+    def _prefetch(self, i):
+        with self.lock:
+            for j in range(i + 1, min(i + 1 + self.read_ahead, self.n_frames)):
+                if j not in self.cache and j not in self.pending:
+                    self.pending[j] = self.pool.submit(self._load, j)
+
+    def frame(self, i):
+        if i < 0:
+            i += self.n_frames
+        if not 0 <= i < self.n_frames:
+            raise IndexError("Frame " + str(i) + " is out of range, the session has " + str(self.n_frames))
+        frame = self._cached(i)
+        if frame is not None:
+            self.hits += 1
+        else:
+            with self.lock:
+                future = self.pending.get(i)
+            if future is not None:
+                frame = future.result() # decoded ahead, or still being decoded
+                self.hits += 1
+            else:
+                frame = self._load(i)
+                self.misses += 1
+        if self.pool is not None:
+            self._prefetch(i)
+        return frame
+
+    def frames(self, indices):
+        # {stream: (n, ...) array} of the frames at indices, in that order
+        frames = [self.frame(i) for i in indices]
+        return {name: np.stack([frame[name] for frame in frames]) for name in self.streams}
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.frames(range(*key.indices(self.n_frames)))
+        return self.frame(key)
+
+    def __iter__(self):
+        for i in range(self.n_frames):
+            yield self.frame(i)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
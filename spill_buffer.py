@@ -0,0 +1,94 @@
+# Description: Overflow tier of the frame buffer, frames wait unencoded in a memory-mapped scratch file
+
+import os
+import threading
+import numpy as np
+
+from frame_buffer import FrameSlot, slot_arrays
+from raw_session import RawStreamWriter, open_stream, HEADER_BYTES, RAW_FMT
+from frame_trace import now_ns
+
+
+SPILL_FILE = 'spill' + RAW_FMT
+
+
+class SpillBuffer:
+    """
+    Ring of `capacity` frames in a scratch file next to a FrameBuffer. The file
+    is a raw stream whose frames are whole slots (same layout and stride as the
+    buffer), so a crashed session can still be read with open_stream.
+
+    The capture thread fills a spill slot with acquire() and hands it over with
+    commit(); the saving thread copies the oldest one into a free buffer slot
+    with get_into(). Frames leave in the order they came in. Writes go to the
+    page cache, the kernel writes them back when it needs the memory.
+    """
+    def __init__(self, frame_buffer, path, capacity):
+        if capacity < 1:
+            raise ValueError("The spill file needs room for at least one frame")
+        self.frame_buffer = frame_buffer
+        self.path = path
+        self.capacity = capacity
+        self.layout, self.stride = frame_buffer.layout, frame_buffer.stride
+
+        layout = [[name, list(shape), dtype, offset] for name, shape, dtype, offset in self.layout]
+        RawStreamWriter(path, (self.stride,), np.uint8, frame_buffer.config,
+                        extra={'layout': layout, 'geometry': frame_buffer.geometry}).close()
+        with open(path, 'r+b') as f:
+            f.truncate(HEADER_BYTES + capacity * self.stride) # sparse, blocks are allocated as frames arrive
+        self.map = open_stream(path, mode='r+')
+        self.slots = [FrameSlot(i, slot_arrays(self.map, self.layout, self.stride, i)) for i in range(capacity)]
+
+        self.head = 0 # next slot to read
+        self.count = 0 # frames waiting
+        self.total = 0 # frames that went through the file
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # the slot the next frame is written to, None if the file is full
+        with self.lock:
+            if self.count == self.capacity:
+                return None
+            return self.slots[(self.head + self.count) % self.capacity]
+
+    def commit(self, slot):
+        self.frame_buffer.stamp(slot)
+        with self.lock:
+            self.count += 1
+            self.total += 1
+            self.peak = max(self.peak, self.count)
+
+    def get_into(self, dst):
+        # copy the oldest spilled frame into the buffer slot dst, None if nothing is waiting
+        with self.lock:
+            if self.count == 0:
+                return None
+            src = self.slots[self.head]
+        for name in src.streams:
+            np.copyto(getattr(dst, name), getattr(src, name))
+        dst.timestamp = src.timestamp
+        dst.seq = src.seq
+        dst.trace[...] = src.trace
+        dst.meta[...] = src.meta
+        dst.trace['dequeue_ns'] = now_ns()
+        with self.lock:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        return dst
+
+    def qsize(self):
+        return self.count
+
+    def empty(self):
+        return self.count == 0
+
+    def full(self):
+        return self.count == self.capacity
+
+    def close(self):
+        # unmap and delete the scratch file, frames still in it are lost
+        self.slots = [] # the last views of the map, it is unmapped with them
+        self.map = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,47 @@
+# Description: Shared fixtures of the tests, the modules are imported from the repository root
+# usage: python -m pytest -q tests
+# Modules that need pyk4a (frame sizes come from its enums) skip themselves when it is not installed.
+
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def config():
+    # the smallest color and depth modes, frames are cheap to generate and copy
+    pyk4a = pytest.importorskip('pyk4a')
+    return pyk4a.Config(color_resolution=pyk4a.ColorResolution.RES_720P,
+                        depth_mode=pyk4a.DepthMode.NFOV_2X2BINNED,
+                        color_format=pyk4a.ImageFormat.COLOR_BGRA32,
+                        camera_fps=pyk4a.FPS.FPS_30)
+
+
+def run_capture(session, n_frames, save=True):
+    # grab n_frames on a capture thread like headless mode, saving on this thread unless save=False;
+    # stops early when the 'stop' policy finds the buffer full, returns True in that case
+    stop = threading.Event()
+
+    def capture_loop():
+        while not stop.is_set() and session.captured < n_frames:
+            session.grab()
+        stop.set()
+
+    thread = threading.Thread(target=capture_loop, daemon=True)
+    thread.start()
+    full = False
+    while not stop.is_set():
+        if session.backpressure == 'stop' and session.buffer_full():
+            full = True
+            break
+        if save:
+            session.save_next(timeout=0.01)
+        else:
+            stop.wait(0.01)
+    stop.set()
+    session.request_stop()
+    thread.join()
+    return full
@@ -0,0 +1,123 @@
+# Description: Backpressure policies when the frame buffer is full, also with encoders slower than the camera
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+import encoder_pool
+from encoder_pool import EncoderPool
+from frame_buffer import FrameBuffer
+from frame_sources import SyntheticSource
+from capture_pipeline import CaptureSession, SESSION_FILE
+from conftest import run_capture
+
+
+def open_session(config, saving_dir, backpressure, capacity=8):
+    # frames are written inline by the saving thread (no encoder processes)
+    device = SyntheticSource(config, fps=200).start()
+    frame_buffer = FrameBuffer(config, capacity, depth_dtype=np.uint8)
+    session = CaptureSession(device, frame_buffer, EncoderPool(0), str(saving_dir), '.png', config,
+                             trace=False, backpressure=backpressure).open()
+    return session, frame_buffer
+
+def grab_unsaved(session, frame_buffer, n_grabs):
+    # n_grabs camera frames with nothing saved meanwhile, then save what is left; returns session.json
+    try:
+        for _ in range(n_grabs):
+            session.grab(timeout=0)
+        session.drain().close()
+    finally:
+        frame_buffer.close()
+    with open(os.path.join(session.saving_dir, SESSION_FILE)) as f:
+        return json.load(f)
+
+
+def test_drop_newest_keeps_the_first_frames(config, tmp_path):
+    session, frame_buffer = open_session(config, tmp_path / 'drop_newest', 'drop_newest')
+    info = grab_unsaved(session, frame_buffer, 20)
+    assert info['captured'] == info['saved'] == 8
+    assert info['dropped_newest'] == 12
+    assert info['dropped_oldest'] == info['not_saved'] == 0
+
+
+def test_drop_oldest_keeps_the_last_frames(config, tmp_path):
+    session, frame_buffer = open_session(config, tmp_path / 'drop_oldest', 'drop_oldest')
+    info = grab_unsaved(session, frame_buffer, 20)
+    assert info['captured'] == 20
+    assert info['dropped_oldest'] == 12
+    assert info['saved'] == 8
+    assert info['dropped_newest'] == info['not_saved'] == 0
+
+
+def test_stop_when_the_buffer_is_full(config, tmp_path):
+    session, frame_buffer = open_session(config, tmp_path / 'stop', 'stop')
+    try:
+        assert run_capture(session, 100, save=False)
+        assert session.captured == 8
+        session.close()
+    finally:
+        frame_buffer.close()
+    assert session.info()['not_saved'] == 8
+
+
+def test_block_saves_every_frame(config, tmp_path):
+    session, frame_buffer = open_session(config, tmp_path / 'block', 'block', capacity=2)
+    try:
+        assert not run_capture(session, 30)
+        session.drain().close()
+    finally:
+        frame_buffer.close()
+    assert session.saved == session.captured == 30
+    assert session.dropped_newest == session.dropped_oldest == 0
+
+
+@pytest.fixture
+def slow_pool(monkeypatch):
+    # two encoders taking 200 ms a frame, threads instead of processes so the encoder can be replaced
+    def slow_encode(*args, **kwargs):
+        time.sleep(0.2)
+        return (0, 0)
+    monkeypatch.setattr(encoder_pool, 'encode_slot', slow_encode)
+    pool = EncoderPool(2)
+    pool.executor.shutdown()
+    pool.executor = ThreadPoolExecutor(2)
+    yield pool
+    pool.shutdown()
+
+
+def slow_session(config, pool, saving_dir, backpressure):
+    device = SyntheticSource(config, fps=200).start()
+    frame_buffer = FrameBuffer(config, 8, depth_dtype=np.uint8, shared=True)
+    session = CaptureSession(device, frame_buffer, pool, str(saving_dir), '.png', config,
+                             trace=False, backpressure=backpressure).open()
+    return session, frame_buffer
+
+
+def test_stop_when_encoders_fall_behind(config, slow_pool, tmp_path):
+    # the slots with the encoders count, the capture stops once the buffer is full
+    session, frame_buffer = slow_session(config, slow_pool, tmp_path / 'stop', 'stop')
+    try:
+        assert run_capture(session, 100)
+        assert session.captured < 100
+    finally:
+        session.drain().close()
+        frame_buffer.close()
+    assert session.saved == session.captured
+
+
+def test_drop_oldest_when_encoders_fall_behind(config, slow_pool, tmp_path):
+    # frames wait in the buffer rather than in the pool queue, so there is always an oldest one to drop
+    session, frame_buffer = slow_session(config, slow_pool, tmp_path / 'drop_oldest', 'drop_oldest')
+    try:
+        assert not run_capture(session, 60)
+        assert session.dropped_oldest > 0
+        assert session.dropped_newest == 0
+        assert slow_pool.in_flight() <= slow_pool.n_workers
+    finally:
+        session.drain().close()
+        frame_buffer.close()
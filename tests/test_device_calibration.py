@@ -0,0 +1,60 @@
+# Description: The calibration saved with a session, from a known calibration blob
+
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+from pyk4a.calibration import CalibrationType
+from device_calibration import calibration_dict, extrinsics, save_calibration, load_calibration
+
+# the depth (D0) and color (PV0) cameras of a factory calibration blob; Rt is relative to the depth camera, in metres
+BLOB = json.dumps({'CalibrationInformation': {'Cameras': [
+    {'Location': 'CALIBRATION_CameraLocationD0',
+     'Rt': {'Rotation': [1, 0, 0, 0, 1, 0, 0, 0, 1], 'Translation': [0, 0, 0]}},
+    {'Location': 'CALIBRATION_CameraLocationPV0',
+     'Rt': {'Rotation': [0.99998, 0.00503, -0.00397, -0.00474, 0.99766, 0.06819, 0.00430, -0.06817, 0.99766],
+            'Translation': [-0.032088, -0.002151, 0.003978]}},
+]}})
+
+
+class BlobCalibration:
+    # what pyk4a 1.5.0 returns for BLOB: the SDK reads the blob into millimetres, pyk4a divides them by 1000
+    calibration_raw = BLOB
+
+    def __init__(self):
+        cameras = {c['Location']: c['Rt'] for c in json.loads(BLOB)['CalibrationInformation']['Cameras']}
+        self.rt = cameras['CALIBRATION_CameraLocationPV0']
+        self.sdk_translation_mm = np.array(self.rt['Translation']) * 1000
+
+    def get_camera_matrix(self, kind):
+        return np.array([[500.0, 0, 320], [0, 500.0, 288], [0, 0, 1]])
+
+    def get_distortion_coefficients(self, kind):
+        return np.zeros(8)
+
+    def get_extrinsic_parameters(self, source, target):
+        assert (source, target) == (CalibrationType.DEPTH, CalibrationType.COLOR)
+        return np.reshape(self.rt['Rotation'], (3, 3)), np.reshape(self.sdk_translation_mm, (1, 3)) / 1000
+
+
+def test_translation_in_millimetres(tmp_path):
+    calibration = calibration_dict(BlobCalibration())
+    params = calibration['depth_to_color']
+    assert params['unit'] == 'mm'
+    np.testing.assert_allclose(params['translation'], [-32.088, -2.151, 3.978])
+
+    save_calibration(str(tmp_path), calibration)
+    rotation, translation = extrinsics(load_calibration(str(tmp_path)))
+    np.testing.assert_allclose(translation, [-32.088, -2.151, 3.978])
+    np.testing.assert_allclose(rotation, np.reshape(BlobCalibration().rt['Rotation'], (3, 3)))
+
+
+def test_translation_of_older_sessions_in_metres():
+    # calibration.json files saved before the unit was recorded hold pyk4a's metres
+    calibration = calibration_dict(BlobCalibration())
+    params = calibration['depth_to_color']
+    params['translation'] = (np.array(params['translation']) / 1000).tolist()
+    del params['unit']
+    np.testing.assert_allclose(extrinsics(calibration)[1], [-32.088, -2.151, 3.978])
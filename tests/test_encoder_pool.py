@@ -0,0 +1,97 @@
+# Description: Frames are encoded by the worker processes from the shared frame buffer and count as saved once written
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+import encoder_pool
+from encoder_pool import EncoderPool
+from frame_buffer import FrameBuffer
+from frame_sources import SyntheticSource
+from frame_manifest import load_manifest
+from capture_pipeline import CaptureSession
+from conftest import run_capture
+
+
+def test_workers_write_frames_from_shared_memory(config, tmp_path):
+    # 8 frames through 4 slots: a slot is released once its images are written, then filled again
+    frame_buffer = FrameBuffer(config, 4, depth_dtype=np.uint8, shared=True)
+    pool = EncoderPool(2)
+    for stream in ('rgb', 'depth', 'ir'):
+        os.makedirs(os.path.join(str(tmp_path), stream))
+    try:
+        for i in range(8):
+            slot = frame_buffer.acquire(timeout=10)
+            assert slot is not None
+            slot.rgb[:] = i
+            slot.depth[:] = 10 + i
+            slot.ir[:] = 20 + i
+            pool.submit(frame_buffer, slot, str(tmp_path), 'Img_{:04d}'.format(i), '.png')
+        pool.join()
+        assert pool.in_flight() == 0
+        assert all(frame_buffer.acquire(timeout=10) is not None for _ in range(4))
+    finally:
+        pool.shutdown()
+        frame_buffer.close()
+    for i in range(8):
+        for stream, value in (('rgb', i), ('depth', 10 + i), ('ir', 20 + i)):
+            img = cv2.imread(os.path.join(str(tmp_path), stream, 'Img_{:04d}.png'.format(i)), cv2.IMREAD_UNCHANGED)
+            assert img is not None and (img == value).all()
+
+
+@pytest.fixture
+def failing_pool(monkeypatch):
+    # the odd Img_NNNN frames fail to encode
+    def encode(shm_name, layout, stride, index, dir, name, fmt, fsync=False):
+        if int(name[len('Img_'):]) % 2:
+            raise OSError("disk full")
+        return (0, 0)
+    monkeypatch.setattr(encoder_pool, 'encode_slot', encode)
+    pool = EncoderPool(2)
+    pool.executor.shutdown()
+    pool.executor = ThreadPoolExecutor(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_write_errors_are_not_saved(config, failing_pool, tmp_path):
+    device = SyntheticSource(config, fps=100).start()
+    frame_buffer = FrameBuffer(config, 8, depth_dtype=np.uint8, shared=True)
+    session = CaptureSession(device, frame_buffer, failing_pool, str(tmp_path / 'session'), '.png', config,
+                             trace=False, backpressure='block').open()
+    try:
+        run_capture(session, 20)
+    finally:
+        session.drain().close()
+        frame_buffer.close()
+    info = session.info()
+    assert session.write_errors == failing_pool.errors == 10
+    assert session.saved == info['saved'] == 10
+    assert info['not_saved'] == 0
+    assert 'disk full' in session.last_error
+    rows = load_manifest(session.saving_dir)
+    assert len(rows) == 10
+    assert list(rows['index']) == list(range(0, 20, 2)) # the frames that were written
+
+
+def test_buffer_larger_than_shared_memory_is_written_inline(config, monkeypatch, tmp_path):
+    # a /dev/shm smaller than the buffer (e.g. 64 MB in a container): no shared block, the frames are encoded inline
+    import frame_buffer
+    monkeypatch.setattr(frame_buffer, 'shared_memory_free', lambda: 64 * 2**20)
+    buffer = FrameBuffer(config, 100, depth_dtype=np.uint8, shared=True)
+    pool = EncoderPool(2)
+    try:
+        assert buffer.shm_name is None
+        device = SyntheticSource(config, fps=100).start()
+        session = CaptureSession(device, buffer, pool, str(tmp_path / 'session'), '.png', config, trace=False).open()
+        run_capture(session, 3)
+        session.drain().close()
+        assert session.saved == 3
+        assert pool.in_flight() == 0
+    finally:
+        pool.shutdown()
+        buffer.close()
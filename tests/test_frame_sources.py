@@ -0,0 +1,30 @@
+# Description: The synthetic camera drops the frames a slow reader misses, like a device
+
+import time
+import pytest
+
+pytest.importorskip('pyk4a')
+
+from frame_sources import SyntheticSource
+from frame_scheduler import FrameScheduler
+
+FPS = 100
+
+
+def test_lag_shows_as_timestamp_gaps(config):
+    source = SyntheticSource(config, fps=FPS).start()
+    scheduler = FrameScheduler(FPS)
+    for i in range(3):
+        assert scheduler.keep(source.get_capture().color_timestamp_usec)
+    time.sleep(0.1) # ten frame periods without reading
+    last = source.get_capture().color_timestamp_usec
+    scheduler.keep(last)
+    assert last >= 10 * 1e6 / FPS
+    assert scheduler.missed >= 8
+    assert scheduler.achieved_fps < FPS / 2
+
+
+def test_keeps_pace_with_a_fast_reader(config):
+    source = SyntheticSource(config, fps=FPS).start()
+    timestamps = [source.get_capture().color_timestamp_usec for i in range(20)]
+    assert timestamps == [int(i * 1e6 / FPS) for i in range(20)]
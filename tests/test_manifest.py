@@ -0,0 +1,51 @@
+# Description: Manifest rows of a session, the temperature comes from the IMU
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+from encoder_pool import EncoderPool
+from frame_buffer import FrameBuffer
+from frame_sources import SyntheticSource
+from frame_manifest import load_manifest
+from raw_session import RAW_FMT
+from capture_functions import DeviceTemperature
+from capture_pipeline import CaptureSession
+from conftest import run_capture
+
+
+class ImuSource(SyntheticSource):
+    # IMU samples like pyk4a's get_imu_sample()
+    def __init__(self, config, fps=None):
+        super().__init__(config, fps)
+        self.imu_reads = 0
+
+    def get_imu_sample(self, timeout=-1):
+        self.imu_reads += 1
+        return {'temperature': 30.0 + self.imu_reads, 'acc_sample': (0.0, 0.0, 9.8), 'gyro_sample': (0.0, 0.0, 0.0)}
+
+
+def test_temperature_is_read_from_the_imu(config):
+    device = ImuSource(config)
+    temperature = DeviceTemperature(device, period=3600)
+    assert temperature.read() == 31.0
+    assert temperature.read() == 31.0 # throttled, the IMU is read once per period
+    assert device.imu_reads == 1
+    assert np.isnan(DeviceTemperature(SyntheticSource(config)).read()) # sources without an IMU
+
+
+def test_manifest_has_the_temperature(config, tmp_path):
+    device = ImuSource(config, fps=100).start()
+    frame_buffer = FrameBuffer(config, 4, depth_dtype=np.uint16)
+    pool = EncoderPool(0)
+    session = CaptureSession(device, frame_buffer, pool, str(tmp_path / 'session'), RAW_FMT, config, trace=False).open()
+    try:
+        run_capture(session, 5)
+        session.drain().close()
+    finally:
+        frame_buffer.close()
+        pool.shutdown()
+    rows = load_manifest(session.saving_dir)
+    assert len(rows) == 5
+    assert np.all(rows['temperature'] == 31.0)
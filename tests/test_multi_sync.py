@@ -0,0 +1,48 @@
+# Description: Devices in wired sync keep the same frames when their first frames are out of phase
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+from frame_scheduler import FrameScheduler, SyncGrid
+from multi_capture import pair_timestamps
+
+FPS = 30
+FRAME_USEC = 1e6 / FPS
+DELAY_USEC = 160 # subordinate delay off the master
+
+
+def kept(scheduler, timestamps):
+    ts = np.array([t for t in timestamps if scheduler.keep(t)], dtype=np.int64)
+    return np.arange(len(ts)), ts
+
+
+@pytest.mark.parametrize('period_ms, every_n', [(100, 0), (0, 3)])
+def test_out_of_phase_devices_pair(period_ms, every_n):
+    grid = SyncGrid()
+    master = FrameScheduler(FPS, period_ms=period_ms, every_n=every_n, grid=grid)
+    subordinate = FrameScheduler(FPS, period_ms=period_ms, every_n=every_n, grid=grid, offset_usec=DELAY_USEC)
+    rng = np.random.default_rng(0)
+    frames = np.arange(60)
+    master_ts = (frames * FRAME_USEC + rng.integers(-200, 200, len(frames))).astype(np.int64)
+    # the subordinate's first frame comes two camera frames after the master's
+    subordinate_ts = (frames[2:] * FRAME_USEC + DELAY_USEC + rng.integers(-200, 200, len(frames) - 2)).astype(np.int64)
+
+    master_kept = kept(master, master_ts)
+    index, ts = kept(subordinate, subordinate_ts)
+    pairs = pair_timestamps([master_kept, (index, ts - DELAY_USEC)], FRAME_USEC / 2)
+    assert len(pairs) == 20
+    # only the master's first frame was kept before the subordinate started
+    assert pairs[0, 1] == -1
+    assert np.all(pairs[1:, 1] >= 0)
+
+
+def test_schedulers_without_grid_drift_apart():
+    # each scheduler on its own grid keeps frames two camera frames apart
+    master, subordinate = FrameScheduler(FPS, period_ms=100), FrameScheduler(FPS, period_ms=100)
+    frames = np.arange(60)
+    master_kept = kept(master, (frames * FRAME_USEC).astype(np.int64))
+    index, ts = kept(subordinate, (frames[2:] * FRAME_USEC).astype(np.int64))
+    pairs = pair_timestamps([master_kept, (index, ts)], FRAME_USEC / 2)
+    assert np.all(pairs[:, 1] == -1)
@@ -0,0 +1,92 @@
+# Description: Offline registration checked against the depth the SDK transforms to the color camera
+
+import os
+import copy
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+from device_calibration import ray_table, intrinsics
+from session_reader import Session
+from register_session import Registration, session_color_hw
+
+DEPTH_HW = (576, 640)
+COLOR_HW = (720, 1280)
+PLANE_MM = 1500
+
+# ideal lenses, the color camera 32 mm to the left of the depth camera
+CALIBRATION = {
+    'raw': None,
+    'depth': {'matrix': [[500.0, 0, 319.5], [0, 500.0, 287.5], [0, 0, 1]], 'distortion': [0.0] * 8},
+    'color': {'matrix': [[600.0, 0, 639.5], [0, 600.0, 359.5], [0, 0, 1]], 'distortion': [0.0] * 8},
+    'depth_to_color': {'rotation': np.eye(3).tolist(), 'translation': [-32.0, 0.0, 0.0], 'unit': 'mm'},
+}
+
+
+def plane_transformed_depth(calibration):
+    # transformed_depth of a flat wall at PLANE_MM facing both cameras: every color pixel whose ray meets the wall
+    # inside the depth camera's view has the wall depth (a translation along x keeps z)
+    color, _ = intrinsics(calibration, 'color')
+    depth, _ = intrinsics(calibration, 'depth')
+    tx = calibration['depth_to_color']['translation'][0]
+    v, u = np.mgrid[0:COLOR_HW[0], 0:COLOR_HW[1]]
+    x = (u - color[0, 2]) / color[0, 0] - tx / PLANE_MM
+    y = (v - color[1, 2]) / color[1, 1]
+    ud = x * depth[0, 0] + depth[0, 2]
+    vd = y * depth[1, 1] + depth[1, 2]
+    inside = (ud >= -0.5) & (ud < DEPTH_HW[1] - 0.5) & (vd >= -0.5) & (vd < DEPTH_HW[0] - 0.5)
+    return np.where(inside, PLANE_MM, 0).astype(np.uint16)
+
+
+def register_plane(calibration):
+    rays = ray_table(*intrinsics(calibration, 'depth'), DEPTH_HW)
+    depth = np.full((1,) + DEPTH_HW, PLANE_MM, dtype=np.uint16)
+    return Registration(calibration, rays, COLOR_HW).register(depth)[0][0]
+
+
+def footprint_iou(a, b):
+    return np.count_nonzero((a > 0) & (b > 0)) / np.count_nonzero((a > 0) | (b > 0))
+
+
+def test_plane_matches_transformed_depth():
+    registered = register_plane(CALIBRATION)
+    expected = plane_transformed_depth(CALIBRATION)
+    assert footprint_iou(registered, expected) > 0.99 # a unit mix-up moves the footprint by 13 pixels
+    assert np.all(registered[registered > 0] == PLANE_MM)
+
+
+def test_translation_in_metres_is_converted():
+    # calibration.json saved before the unit was recorded, the translation is in metres
+    old = copy.deepcopy(CALIBRATION)
+    old['depth_to_color']['translation'] = [-0.032, 0.0, 0.0]
+    del old['depth_to_color']['unit']
+    np.testing.assert_array_equal(register_plane(old), register_plane(CALIBRATION))
+
+
+def test_recorded_frame_matches_the_sdk():
+    # set MYK4A_NATIVE_SESSION to a session recorded with --geometry native by an Azure Kinect
+    session_dir = os.environ.get('MYK4A_NATIVE_SESSION')
+    if not session_dir:
+        pytest.skip("MYK4A_NATIVE_SESSION is not set")
+    transformation = pytest.importorskip('pyk4a.transformation')
+    from pyk4a import Calibration
+    from raw_session import config_from_dict
+
+    with Session(session_dir, streams=('depth',), cache_mb=0) as session:
+        calibration = session.calibration
+        config = config_from_dict(session.info['config'])
+        color_hw = session_color_hw(session)
+        depth = np.asarray(session.frame(0)['depth'])
+    if depth.dtype != np.uint16:
+        pytest.skip("the depth of this session was saved as 8-bit")
+    sdk_calibration = Calibration.from_raw(calibration['raw'], config.depth_mode, config.color_resolution)
+    expected = transformation.depth_image_to_color_camera(depth, sdk_calibration, True)
+    rays = ray_table(*intrinsics(calibration, 'depth'), depth.shape)
+    registered = Registration(calibration, rays, color_hw).register(depth[None])[0][0]
+
+    assert footprint_iou(registered, expected) > 0.95
+    both = (registered > 0) & (expected > 0)
+    error = np.abs(registered[both].astype(np.int32) - expected[both])
+    assert np.median(error) <= 2
+    assert np.mean(error <= 10) > 0.95 # depth edges land a pixel apart
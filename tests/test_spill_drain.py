@@ -0,0 +1,67 @@
+# Description: Frames spilled to the scratch file are saved in capture order, also when a capture is stopped
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('pyk4a')
+
+from encoder_pool import EncoderPool
+from frame_buffer import FrameBuffer
+from frame_sources import SyntheticSource
+from frame_manifest import load_manifest
+from raw_session import RAW_FMT
+from spill_buffer import SPILL_FILE
+from capture_pipeline import CaptureSession
+from frame_trace import load_trace
+from conftest import run_capture
+
+
+def test_spilled_frames_are_saved_in_order(config, tmp_path):
+    # nothing is saved while capturing, the frames after the first two of the buffer go to the spill file
+    device = SyntheticSource(config, fps=200).start()
+    frame_buffer = FrameBuffer(config, 4, depth_dtype=np.uint16)
+    session = CaptureSession(device, frame_buffer, EncoderPool(0), str(tmp_path / 'session'), RAW_FMT, config,
+                             backpressure='drop_newest', spill_gb=0.5, spill_at=0.5).open()
+    spill_path = os.path.join(session.spill_dir, SPILL_FILE)
+    try:
+        run_capture(session, 24, save=False)
+        assert os.path.exists(spill_path)
+        assert session.spill.qsize() == 22
+        session.drain().close()
+    finally:
+        frame_buffer.close()
+    info = session.info()
+    assert info['captured'] == info['saved'] == 24
+    assert info['spilled'] == info['spill_peak'] == 22
+    assert info['dropped_newest'] == info['not_saved'] == 0
+    assert not os.path.exists(spill_path)
+    assert list(load_trace(session.trace.path)['seq']) == list(range(24))
+
+
+def test_stop_saves_the_spilled_frames(config, tmp_path):
+    # nothing is saved while capturing, the frames pile up in the buffer and overflow to the spill file
+    device = SyntheticSource(config, fps=200).start()
+    frame_buffer = FrameBuffer(config, 4, depth_dtype=np.uint16)
+    pool = EncoderPool(0)
+    session = CaptureSession(device, frame_buffer, pool, str(tmp_path / 'session'), RAW_FMT, config,
+                             trace=False, backpressure='drop_newest', spill_gb=0.5, spill_at=0.5).open()
+    spill_path = os.path.join(session.spill_dir, SPILL_FILE)
+    try:
+        run_capture(session, 24, save=False)
+        assert session.captured == 24
+        assert session.spill.qsize() > 0
+        assert os.path.exists(spill_path)
+
+        # what the saving thread does when the capture is stopped
+        left = []
+        session.drain(left.append).close()
+    finally:
+        frame_buffer.close()
+        pool.shutdown()
+
+    assert session.saved == session.captured == 24
+    assert session.info()['not_saved'] == 0
+    assert left[-1] == 0 and left == sorted(left, reverse=True)
+    assert not os.path.exists(spill_path)
+    assert list(load_manifest(session.saving_dir)['seq']) == list(range(24)) # saved in capture order